@@ -0,0 +1,799 @@
+"""Video analysis for the shuttle run assessment.
+
+Kept free of any Flask imports so that worker processes only load OpenCV and
+NumPy when they pick up an analysis job.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from athletes import AthleteTracker, athlete_results, MAX_MATCH_DISTANCE, MAX_MISSED_FRAMES, MIN_ATHLETE_FRAMES
+from calibration import calibrated_distance, check_drift, profile_parameters
+from frame_source import FrameSource, frame_digest, load_frame_index, pipelined_map
+from laps import (CentroidTrack, LineCrossings, find_line_crossings, lap_results, last_lap_unfinished,
+                  LINE_HYSTERESIS, MIN_SIDE_SECONDS)
+from metrics import REGISTRY
+from motion import MotionDetector, corridor_roi, BACKGROUND_LEARNING_RATE, CORRIDOR_MARGIN, MOTION_THRESHOLD
+from overlay import OverlayWriter, overlay_parameters
+
+# Smallest moving area (in full-resolution pixels) that is taken to be the athlete
+MIN_CONTOUR_AREA = 500
+
+# Quality/speed presets for tracking: frames are downscaled to at most
+# max_width pixels wide and only every frame_step-th frame is tracked, except
+# near a suspected line crossing where tracking refines to every frame.
+ANALYSIS_MODES = {
+    'accurate': {'max_width': None, 'frame_step': 1},
+    'balanced': {'max_width': 960, 'frame_step': 2},
+    'fast': {'max_width': 640, 'frame_step': 4},
+}
+
+# Detection threads used alongside the decoder thread when every frame is tracked
+PIPELINE_WORKERS = 2
+
+# Shortest segment worth a process of its own when one video is split up
+MIN_SEGMENT_FRAMES = 250
+
+# How often (in frames) the track is checked for new laps while tracking
+LAP_CHECK_FRAMES = 15
+
+# Extra distance from the endpoints line (in pixels) within which tracking
+# always runs at full frame rate
+REFINE_MARGIN_PIXELS = 10
+
+
+class ShuttleRunAnalyzer:
+    """Shuttle run video analysis
+
+    The analyzer keeps no per-video state: everything a run needs lives in
+    local variables and is returned in a new result dict, so one instance can
+    be shared by any number of threads or processes.
+    """
+
+    def detect_endpoints(self, frame):
+        """Detect endpoints using color detection or manual selection"""
+        # Convert to HSV for better color detection
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        
+        # Define range for red color (common for cones/markers)
+        lower_red = np.array([0, 50, 50])
+        upper_red = np.array([10, 255, 255])
+        
+        # Create mask for red color
+        mask = cv2.inRange(hsv, lower_red, upper_red)
+        
+        # Find contours
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        endpoints = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area > 100:  # Filter small contours
+                # Get bounding rectangle
+                x, y, w, h = cv2.boundingRect(contour)
+                center_x = x + w // 2
+                center_y = y + h // 2
+                endpoints.append((center_x, center_y))
+        
+        return endpoints
+    
+    def calculate_distance(self, point1, point2):
+        """Calculate Euclidean distance between two points in pixels"""
+        return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
+    
+    def calibrate_distance(self, distance_pixels, known_distance_meters=20):
+        """Calibrate pixel to meter conversion using standard shuttle run distance
+
+        Returns the pixels per meter, or 0 if the endpoints coincide.
+        """
+        # Standard shuttle run distance is 20 meters (10 meters each way)
+        if distance_pixels > 0:
+            return distance_pixels / known_distance_meters
+        return 0
+    
+    def choose_calibration(self, distance_pixels, actual_distance_from_video, known_distance_meters):
+        """Pick the calculated or the entered distance for calibration
+
+        Returns (distance_meters, pixels_per_meter).
+        """
+        if actual_distance_from_video:
+            print(f"Actual distance calculated from video: {actual_distance_from_video:.2f} meters")
+
+            # Compare with entered distance
+            difference = abs(actual_distance_from_video - known_distance_meters)
+            accuracy_percentage = (1 - difference / known_distance_meters) * 100
+
+            print(f"Entered distance: {known_distance_meters:.2f} meters")
+            print(f"Calculated distance: {actual_distance_from_video:.2f} meters")
+            print(f"Difference: {difference:.2f} meters")
+            print(f"Accuracy: {accuracy_percentage:.1f}%")
+
+            # Use the calculated distance for calibration if it's reasonable
+            if accuracy_percentage > 70:  # If accuracy is good, use calculated distance
+                print("Using calculated distance for calibration (good accuracy)")
+                distance_meters = actual_distance_from_video
+                pixels_per_meter = distance_pixels / actual_distance_from_video
+            else:
+                print("Using entered distance for calibration (calculated distance seems inaccurate)")
+                pixels_per_meter = self.calibrate_distance(distance_pixels, known_distance_meters)
+                distance_meters = known_distance_meters if pixels_per_meter else 0
+        else:
+            print("Could not calculate actual distance from video, using entered distance")
+            pixels_per_meter = self.calibrate_distance(distance_pixels, known_distance_meters)
+            distance_meters = known_distance_meters if pixels_per_meter else 0
+
+        print(f"Final distance: {distance_meters:.2f} meters")
+        print(f"Calibration: {pixels_per_meter:.2f} pixels per meter")
+        return distance_meters, pixels_per_meter
+    
+    def distance_comparison(self, actual_distance_from_video, known_distance_meters):
+        """Compare the calculated distance with the entered one, or {} if none was calculated"""
+        if not actual_distance_from_video:
+            return {}
+        difference = abs(actual_distance_from_video - known_distance_meters)
+        accuracy_percentage = (1 - difference / known_distance_meters) * 100
+        return {
+            "entered_distance": known_distance_meters,
+            "calculated_distance": actual_distance_from_video,
+            "difference": difference,
+            "accuracy_percentage": accuracy_percentage,
+            "calibration_method": "calculated" if accuracy_percentage > 70 else "entered"
+        }
+    
+    def calculate_actual_distance_from_video(self, source, distance_pixels):
+        """Calculate actual distance by analyzing video content and known reference objects
+
+        Works on the first frame of the FrameSource, so no extra decoding is done.
+        """
+        try:
+            frame = source.first_frame
+            if frame is None:
+                return None
+            
+            # Try to detect reference objects or use video dimensions for estimation
+            height, width = frame.shape[:2]
+            
+            # Method 1: Try to detect human figure for scale reference
+            # Average human height is ~1.7m, we can use this as reference
+            human_height_pixels = self.detect_human_height(frame)
+            
+            if human_height_pixels > 0:
+                # Use human height as reference (average 1.7m)
+                pixels_per_meter = human_height_pixels / 1.7
+                actual_distance = distance_pixels / pixels_per_meter
+                return actual_distance
+            
+            # Method 2: Use video field of view estimation
+            # This is a rough estimation based on typical camera angles
+            # For a standard phone camera at 1.5m height, 2m distance from track
+            estimated_pixels_per_meter = width / 15  # Rough estimation for typical setup
+            actual_distance = distance_pixels / estimated_pixels_per_meter
+            return actual_distance
+            
+        except Exception as e:
+            print(f"Error calculating actual distance: {str(e)}")
+            return None
+    
+    def detect_human_height(self, frame):
+        """Detect human figure and estimate height in pixels"""
+        try:
+            # Convert to grayscale
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            
+            # Use background subtraction to find moving objects
+            # This is a simplified approach - in practice, you'd use more sophisticated methods
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            
+            # Create mask for skin color detection (simplified)
+            lower_skin = np.array([0, 20, 70], dtype=np.uint8)
+            upper_skin = np.array([20, 255, 255], dtype=np.uint8)
+            mask = cv2.inRange(hsv, lower_skin, upper_skin)
+            
+            # Find contours
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            
+            if contours:
+                # Get largest contour (likely the person)
+                largest_contour = max(contours, key=cv2.contourArea)
+                if cv2.contourArea(largest_contour) > 1000:  # Filter small detections
+                    x, y, w, h = cv2.boundingRect(largest_contour)
+                    return h  # Return height in pixels
+            
+            return 0
+            
+        except Exception as e:
+            print(f"Error detecting human height: {str(e)}")
+            return 0
+    
+    def track_athlete_movement(self, video_path, target_laps=10, known_distance_meters=20,
+                               progress_callback=None, max_width=None, frame_step=1,
+                               pipeline_workers=0, segment_processes=1, return_track=False,
+                               multi_athlete=False, calibration=None, overlay_path=None,
+                               background_learning_rate=BACKGROUND_LEARNING_RATE):
+        """Process video to track athlete movement and calculate lap times
+
+        If given, progress_callback is called with an event dict: a
+        "progress" event with processed_frames, total_frames and
+        eta_seconds every 100 frames, and a "lap" event each time the
+        athlete crosses the line. max_width and
+        frame_step trade accuracy for speed, see ANALYSIS_MODES. With
+        pipeline_workers > 0, decoding and detection overlap on separate
+        threads; the results are the same as the serial loop. With
+        segment_processes > 1, long videos are split at keyframes and the
+        segments are tracked in parallel processes before the lap logic runs
+        over the stitched track. With multi_athlete, every moving blob is
+        tracked with a persistent ID and the result gains an "athletes" list
+        with each one's laps; the whole video is then tracked even after the
+        main (largest) athlete finishes. With return_track, the result also
+        holds the motion track and its metadata under "track", "track_info"
+        and, with multi_athlete, "athlete_track" (not JSON serializable) for
+        reanalyze_track. calibration is a station's calibration profile: its
+        endpoints and scale are used instead of detecting them, and the
+        first frame is only checked against the profile's markers. With
+        overlay_path (a path without extension), an annotated overlay video is
+        rendered from the tracked frames, and the result gains an "overlay"
+        dict describing it; the video is then tracked in one process.
+        background_learning_rate is the weight of each frame in the running
+        average background; 0 keeps the first frame as a fixed background,
+        which suits fixed stations with steady light and is what lets
+        segment_processes split a video.
+        """
+        overlay = None
+        source = detections = None
+        try:
+            print(f"Opening video: {video_path}")
+            source = FrameSource(video_path)
+            
+            if not source.is_opened():
+                print("Error: Could not open video file")
+                return {"error": "Could not open video file"}
+            
+            fps = source.fps
+            frame_count = source.frame_count
+            duration = frame_count / fps
+            
+            print(f"Video info - FPS: {fps}, Frames: {frame_count}, Duration: {duration:.2f}s")
+            
+            # Get first frame to detect endpoints
+            first_frame = source.first_frame
+            if first_frame is None:
+                print("Error: Could not read first frame")
+                source.release()
+                return {"error": "Could not read video"}
+            
+            drift = None
+            if calibration is not None:
+                # Fixed station: reuse its saved endpoints and scale
+                endpoints = [tuple(point) for point in calibration["endpoints"]]
+                print(f"Using calibration profile for station {calibration['station_id']}: {endpoints}")
+                with REGISTRY.timer('drift_check'):
+                    drift = check_drift(calibration, first_frame)
+                if drift["drifted"]:
+                    print(f"Warning: {drift['warning']}")
+                
+                distance_pixels = self.calculate_distance(endpoints[0], endpoints[1])
+                actual_distance_from_video = None
+                distance_meters, pixels_per_meter = calibrated_distance(calibration, endpoints)
+                print(f"Calibration: {pixels_per_meter:.2f} pixels per meter")
+            else:
+                print("Detecting endpoints...")
+                # Detect endpoints in first frame
+                with REGISTRY.timer('endpoints'):
+                    endpoints = self.detect_endpoints(first_frame)
+                print(f"Detected {len(endpoints)} endpoints: {endpoints}")
+                
+                if len(endpoints) < 2:
+                    print("Warning: Could not detect at least 2 endpoints")
+                    # For testing, create dummy endpoints if none detected
+                    if len(endpoints) == 0:
+                        h, w = first_frame.shape[:2]
+                        endpoints = [(w//4, h//2), (3*w//4, h//2)]
+                        print(f"Using dummy endpoints: {endpoints}")
+                    else:
+                        source.release()
+                        return {"error": "Could not detect at least 2 endpoints. Please ensure red markers are visible."}
+                
+                # Calculate distance between endpoints
+                distance_pixels = self.calculate_distance(endpoints[0], endpoints[1])
+                
+                # Calculate actual distance from video analysis
+                print("Calculating actual distance from video analysis...")
+                with REGISTRY.timer('distance_estimate'):
+                    actual_distance_from_video = self.calculate_actual_distance_from_video(source, distance_pixels)
+                
+                distance_meters, pixels_per_meter = self.choose_calibration(
+                    distance_pixels, actual_distance_from_video, known_distance_meters)
+            
+            # Tracking runs on a downscaled copy of the lane around the
+            # endpoints; centroids are mapped back to full resolution so they
+            # can be compared with the endpoints
+            scale = 1.0
+            if max_width and first_frame.shape[1] > max_width:
+                scale = max_width / first_frame.shape[1]
+            roi = corridor_roi(endpoints, first_frame.shape[1], first_frame.shape[0])
+            
+            # Background subtraction against a running average seeded from frame 0
+            detector = MotionDetector(first_frame, roi, scale, MIN_CONTOUR_AREA * scale * scale,
+                                      learning_rate=background_learning_rate)
+            
+            # Track athlete position; laps are worked out from the whole track
+            track = CentroidTrack(capacity=frame_count + 1)
+            athletes = None
+            if multi_athlete:
+                athletes = AthleteTracker(MAX_MATCH_DISTANCE * distance_pixels, capacity=4 * (frame_count + 1))
+            crossings = np.empty(0)
+            live_crossings = LineCrossings(endpoints)
+            reported_laps = 0
+            
+            # Rendered from the frames decoded for tracking below
+            overlay_result = None
+            if overlay_path:
+                try:
+                    overlay = OverlayWriter(overlay_path, fps, first_frame.shape[1::-1], endpoints, target_laps,
+                                            LAP_CHECK_FRAMES)
+                except RuntimeError as e:
+                    print(f"Warning: {str(e)}")
+                    overlay_result = {"error": str(e)}
+            
+            def report_laps(crossings, reported_laps):
+                """Send a lap event for each crossing found since the last call"""
+                for lap in range(reported_laps, min(len(crossings), target_laps)):
+                    lap_time = float(crossings[lap] - crossings[lap - 1]) if lap else None
+                    print(f"Lap {lap + 1} completed at {crossings[lap]:.2f}s")
+                    if progress_callback:
+                        progress_callback({"event": "lap", "lap": lap + 1,
+                                           "time": float(crossings[lap]), "lap_time": lap_time})
+                return max(reported_laps, min(len(crossings), target_laps))
+            
+            processed_frames = 0
+            tracked_frames = 0
+            last_progress_frames = 0
+            last_lap_check_frames = 0
+            stopped_early = False
+            last_line_distance = None
+            
+            tracking_started = time.time()
+            print(f"Starting athlete tracking of lane {roi} at {detector.size[0]}x{detector.size[1]}, "
+                  f"every {frame_step} frame(s)...")
+            
+            # Cropping and colour conversion are independent per frame, so with
+            # every frame needed they run on worker threads while a decoder
+            # thread reads ahead. The background model needs the frames in
+            # order, and frame skipping decides what to decode next from the
+            # latest centroid, so both stay on this thread.
+            # Segments are decoded in other processes, which the overlay cannot see
+            segment_track = None
+            if frame_step == 1 and segment_processes > 1 and overlay is None:
+                segment_track = self.track_segments(video_path, frame_count, detector, segment_processes)
+            
+            # Each detection comes with the frame scaled for the overlay, or None
+            if segment_track is not None:
+                detections = ((frame_number, blobs, None) for frame_number, blobs in segment_track)
+            elif frame_step == 1 and pipeline_workers > 0:
+                print(f"Pipelining decode with {pipeline_workers} preparation thread(s)")
+                def prepare(frame_number, frame, buffers):
+                    return detector.prepare(frame, buffers), overlay.scaled(frame) if overlay else None
+                
+                # Only the generator expression may hold the pipeline, so
+                # closing it below joins the decoder thread before the
+                # capture is released
+                detections = ((frame_number, detector.detect(gray) if frame_number else [], picture)
+                              for frame_number, (gray, picture) in pipelined_map(
+                                  source, prepare, workers=pipeline_workers, scratch=detector.new_buffers))
+            else:
+                source.frame_step = frame_step
+                detections = ((frame_number, detector.detect_frame(frame) if frame_number else [],
+                               overlay.scaled(frame) if overlay else None)
+                              for frame_number, frame in source)
+            
+            # Continues from frame 0, which the source has already decoded
+            for frame_number, blobs, picture in detections:
+                current_time = frame_number / fps
+                tracked_frames += 1
+                if athletes is not None:
+                    athletes.update(frame_number, current_time, blobs)
+                if overlay is not None:
+                    overlay.add(frame_number, picture, blobs[0][:2] if blobs else None)
+                
+                # The largest blob is taken to be the main athlete
+                if blobs:
+                    cx, cy, area = blobs[0]
+                    track.append(frame_number, current_time, cx, cy, area)
+                    
+                    # Sample sparsely, but switch to every frame while the
+                    # athlete could reach the line before the next sample
+                    if frame_step > 1:
+                        line_distance = self.signed_line_distance((cx, cy), endpoints)
+                        speed = 0
+                        if last_line_distance is not None:
+                            speed = (abs(line_distance - last_line_distance[0]) /
+                                     (frame_number - last_line_distance[1]))
+                        last_line_distance = (line_distance, frame_number)
+                        reach = 2 * speed * frame_step + REFINE_MARGIN_PIXELS
+                        source.frame_step = 1 if abs(line_distance) <= reach else frame_step
+                
+                processed_frames = frame_number + 1
+                
+                # Check the track since the last lap for new laps, to report
+                # them as they happen and to stop once the target is reached
+                if processed_frames - last_lap_check_frames >= LAP_CHECK_FRAMES:
+                    last_lap_check_frames = processed_frames
+                    with REGISTRY.timer('lap_logic'):
+                        crossings = live_crossings.update(track.rows)
+                    reported_laps = report_laps(crossings, reported_laps)
+                    if overlay is not None:
+                        overlay.update_laps(crossings, current_time)
+                    if len(crossings) >= target_laps and not multi_athlete:
+                        stopped_early = True
+                        break
+                
+                # Progress update every 100 frames
+                if processed_frames - last_progress_frames >= 100:
+                    last_progress_frames = processed_frames
+                    print(f"Processed {processed_frames} frames...")
+                    if progress_callback:
+                        elapsed = time.time() - tracking_started
+                        remaining_frames = max(0, frame_count - processed_frames)
+                        progress_callback({"event": "progress",
+                                           "processed_frames": processed_frames,
+                                           "total_frames": frame_count,
+                                           "eta_seconds": elapsed * remaining_frames / processed_frames})
+            
+            # Stops the pipeline threads if tracking ended early
+            detections.close()
+            source.release()
+            print(f"Video processing completed. Processed {processed_frames} frames")
+            
+            with REGISTRY.timer('lap_logic'):
+                crossings = find_line_crossings(track.rows, endpoints)
+            report_laps(crossings, reported_laps)
+            if overlay is not None:
+                overlay_result = overlay.close(crossings)
+                overlay = None
+            
+            # Includes the time since the last crossing if the athlete didn't complete all laps
+            current_lap, lap_times = lap_results(crossings, target_laps, duration)
+            
+            print(f"Final results - Laps: {current_lap}/{target_laps}, Lap times: {lap_times}")
+            
+            # Prepare comparison data
+            comparison_data = self.distance_comparison(actual_distance_from_video, known_distance_meters)
+            
+            result = {
+                "total_laps": current_lap,
+                "target_laps": target_laps,
+                "lap_times": lap_times,
+                "last_lap_unfinished": last_lap_unfinished(crossings, target_laps),
+                "distance_pixels": distance_pixels,
+                "distance_meters": distance_meters,
+                "distance": distance_meters,  # Main distance in meters
+                "pixels_per_meter": pixels_per_meter,
+                "endpoints": endpoints,
+                "duration": duration,
+                "processed_frames": processed_frames,
+                "tracked_frames": tracked_frames,
+                "distance_comparison": comparison_data
+            }
+            if calibration is not None:
+                result["calibration"] = dict(profile_parameters(calibration), drift=drift)
+            if overlay_result is not None:
+                result["overlay"] = overlay_result
+            if athletes is not None:
+                result["athletes"] = athlete_results(athletes.rows, endpoints, target_laps, duration)
+                print(f"Tracked {len(result['athletes'])} athlete(s)")
+            
+            if return_track:
+                # Everything reanalyze_track needs to redo the laps and calibration
+                result["track"] = track.rows.copy()
+                result["track_info"] = {
+                    "endpoints": [list(point) for point in endpoints],
+                    "fps": fps,
+                    "duration": duration,
+                    "frame_count": frame_count,
+                    "processed_frames": processed_frames,
+                    "tracked_frames": tracked_frames,
+                    "target_laps": target_laps,
+                    "complete": not stopped_early,
+                    "roi": list(roi),
+                    "frame_size": [first_frame.shape[1], first_frame.shape[0]],
+                    "frame_step": frame_step,
+                    "estimated_pixels_per_meter": (distance_pixels / actual_distance_from_video
+                                                   if actual_distance_from_video else None),
+                    "calibration": result.get("calibration")
+                }
+                if athletes is not None:
+                    result["athlete_track"] = athletes.rows.copy()
+            return result
+            
+        except Exception as e:
+            print(f"Error in track_athlete_movement: {str(e)}")
+            if overlay is not None:
+                overlay.abort()
+            return {"error": f"Video processing error: {str(e)}"}
+        finally:
+            # Also after an error: stop the pipeline threads before the
+            # capture they read from is released
+            if detections is not None:
+                detections.close()
+            if source is not None:
+                source.release()
+    
+    def reanalyze_track(self, rows, track_info, target_laps=10, known_distance_meters=20, endpoints=None,
+                        athlete_rows=None):
+        """Recompute calibration, laps and lap times from a saved motion track
+
+        rows, track_info and athlete_rows are the "track", "track_info" and
+        "athlete_track" returned by track_athlete_movement. Nothing is
+        decoded, so this takes milliseconds. endpoints may override the
+        detected ones. Tracks made with a calibration profile keep its scale.
+        """
+        endpoints = [tuple(point) for point in (endpoints or track_info["endpoints"])]
+        distance_pixels = self.calculate_distance(endpoints[0], endpoints[1])
+        calibration = track_info.get("calibration")
+        
+        actual_distance_from_video = None
+        if calibration:
+            distance_meters, pixels_per_meter = calibrated_distance(calibration, endpoints)
+        else:
+            if track_info["estimated_pixels_per_meter"]:
+                actual_distance_from_video = distance_pixels / track_info["estimated_pixels_per_meter"]
+            distance_meters, pixels_per_meter = self.choose_calibration(
+                distance_pixels, actual_distance_from_video, known_distance_meters)
+        
+        crossings = find_line_crossings(rows, endpoints)
+        total_laps, lap_times = lap_results(crossings, target_laps, track_info["duration"])
+        
+        result = {
+            "total_laps": total_laps,
+            "target_laps": target_laps,
+            "lap_times": lap_times,
+            "last_lap_unfinished": last_lap_unfinished(crossings, target_laps),
+            "distance_pixels": distance_pixels,
+            "distance_meters": distance_meters,
+            "distance": distance_meters,  # Main distance in meters
+            "pixels_per_meter": pixels_per_meter,
+            "endpoints": endpoints,
+            "duration": track_info["duration"],
+            "processed_frames": track_info["processed_frames"],
+            "tracked_frames": track_info["tracked_frames"],
+            "distance_comparison": self.distance_comparison(actual_distance_from_video, known_distance_meters)
+        }
+        if calibration:
+            result["calibration"] = calibration
+        if athlete_rows is not None:
+            result["athletes"] = athlete_results(athlete_rows, endpoints, target_laps, track_info["duration"])
+        return result
+    
+    def track_segments(self, video_path, frame_count, detector, processes):
+        """Detect the athlete in every frame by tracking segments in parallel processes
+
+        Each segment starts from a copy of the frame-0 background model, so
+        splitting only gives the serial results when the background is fixed
+        (a zero learning rate). Returns [(frame_number, blobs)] for the
+        whole video, or None when the background adapts, the video is too
+        short to split, or a segment did not start exactly where the
+        previous one ended, in frames or in background model; the caller then
+        tracks serially.
+        """
+        # An adapting background depends on every earlier frame, which a
+        # segment starting part-way through cannot reproduce exactly
+        if detector.learning_rate:
+            print("Background model adapts to every frame, tracking in one pass instead of segments "
+                  "(a background learning rate of 0 allows segments)")
+            return None
+        
+        boundaries = segment_boundaries(frame_count, processes, load_frame_index(video_path).keyframes)
+        if not boundaries:
+            return None
+        
+        starts = [0] + boundaries
+        ends = boundaries + [None]
+        print(f"Tracking {len(starts)} segments in parallel, starting at frames {starts}")
+        
+        count = len(starts)
+        with ProcessPoolExecutor(max_workers=min(processes, count)) as pool:
+            segments = list(pool.map(track_segment, [video_path] * count, starts, ends, [detector] * count))
+        
+        # Seeking is only trusted if each segment's first frame is the frame the
+        # previous segment decoded right after its last one, and the segment
+        # starts with the background model the previous one ended with
+        for previous, current in zip(segments, segments[1:]):
+            if (len(previous['blobs']) != current['start'] - previous['start'] or
+                    previous['boundary_digest'] != current['first_digest'] or
+                    previous['end_state'] != current['start_state']):
+                print(f"Segment at frame {current['start']} did not line up, tracking serially instead")
+                return None
+        
+        track = []
+        for segment in segments:
+            REGISTRY.merge(segment['metrics'])
+            track.extend(enumerate(segment['blobs'], start=segment['start']))
+        return track
+    
+    def signed_line_distance(self, point, endpoints):
+        """Signed perpendicular distance in pixels from point to the line between endpoints"""
+        (x1, y1), (x2, y2) = endpoints[0], endpoints[1]
+        length = np.hypot(x2 - x1, y2 - y1)
+        if length == 0:
+            return 0.0
+        return ((x2 - x1) * (point[1] - y1) - (y2 - y1) * (point[0] - x1)) / length
+
+
+# The analyzer is stateless, so one shared instance serves every job
+_analyzer = ShuttleRunAnalyzer()
+
+
+def tracking_parameters(analysis_mode, multi_athlete=False, calibration=None,
+                        background_learning_rate=BACKGROUND_LEARNING_RATE):
+    """Settings that change the motion track; changing them means decoding again"""
+    parameters = {
+        'analysis_mode': analysis_mode,
+        'mode_settings': ANALYSIS_MODES[analysis_mode],
+        'motion_threshold': MOTION_THRESHOLD,
+        'min_contour_area': MIN_CONTOUR_AREA,
+        'background_learning_rate': background_learning_rate,
+        'corridor_margin': CORRIDOR_MARGIN,
+        'refine_margin': REFINE_MARGIN_PIXELS
+    }
+    if multi_athlete:
+        parameters.update(multi_athlete=True, max_match_distance=MAX_MATCH_DISTANCE,
+                          max_missed_frames=MAX_MISSED_FRAMES, min_athlete_frames=MIN_ATHLETE_FRAMES)
+    if calibration:
+        # The tracked lane comes from the profile's endpoints, and the track
+        # keeps the profile's scale for reanalysis
+        parameters['calibration'] = profile_parameters(calibration)
+    return parameters
+
+
+def analysis_parameters(target_laps, known_distance_meters, analysis_mode, endpoints=None, multi_athlete=False,
+                        calibration=None, overlay=False, background_learning_rate=BACKGROUND_LEARNING_RATE):
+    """Every setting that can change an analysis result, e.g. for cache keys"""
+    parameters = dict(tracking_parameters(analysis_mode, multi_athlete, calibration, background_learning_rate),
+                      target_laps=target_laps,
+                      known_distance=known_distance_meters,
+                      line_hysteresis=LINE_HYSTERESIS,
+                      min_side_seconds=MIN_SIDE_SECONDS)
+    if endpoints:
+        parameters['endpoints'] = [list(point) for point in endpoints]
+    if overlay:
+        parameters['overlay'] = overlay_parameters()
+    return parameters
+
+
+def warm_up():
+    """Run endpoint detection, tracking and lap logic on a small synthetic clip
+
+    The first calls into OpenCV load code and allocate thread pools; doing
+    that at startup keeps it out of the first real analysis. Returns the
+    seconds taken.
+    """
+    started = time.perf_counter()
+    frame = np.full((240, 320, 3), 90, dtype=np.uint8)
+    for x in (40, 280):
+        cv2.rectangle(frame, (x - 8, 112), (x + 8, 128), (0, 0, 255), -1)
+    endpoints = _analyzer.detect_endpoints(frame)
+    
+    # Both the full-resolution and the downscaled detection paths
+    for scale in (1.0, 0.5):
+        detector = MotionDetector(frame, corridor_roi(endpoints, 320, 240), scale,
+                                  MIN_CONTOUR_AREA * scale * scale)
+        track = CentroidTrack(capacity=4)
+        for frame_number, y in enumerate((60, 100, 140, 180), start=1):
+            moving = frame.copy()
+            cv2.rectangle(moving, (150, y - 25), (170, y + 25), (230, 230, 230), -1)
+            for cx, cy, area in detector.detect_frame(moving)[:1]:
+                track.append(frame_number, frame_number / 30, cx, cy, area)
+        lap_results(find_line_crossings(track.rows, endpoints), 1, 4 / 30)
+    return time.perf_counter() - started
+
+
+def track_covers_endpoints(track_info, endpoints):
+    """True if a stored motion track can be used to time laps over other endpoints
+
+    Tracking only looks at the lane around the original endpoints, so the
+    new endpoints, with at least half the usual lane margin around them, have
+    to lie inside it. The faster modes only track
+    every frame near the original line, so their tracks never qualify.
+    Tracks stored without their lane don't either.
+    """
+    if 'roi' not in track_info or track_info.get('frame_step', 1) > 1:
+        return False
+    x0, y0, x1, y1 = corridor_roi(endpoints, *track_info['frame_size'], margin=CORRIDOR_MARGIN / 2)
+    lane_x0, lane_y0, lane_x1, lane_y1 = track_info['roi']
+    return lane_x0 <= x0 and lane_y0 <= y0 and x1 <= lane_x1 and y1 <= lane_y1
+
+
+def segment_boundaries(frame_count, segments, keyframes=None):
+    """Frame numbers at which to split a video into up to `segments` parts
+
+    Boundaries snap to the nearest keyframe when the keyframes are known, and
+    no part is shorter than MIN_SEGMENT_FRAMES.
+    """
+    segments = min(segments, frame_count // MIN_SEGMENT_FRAMES)
+    targets = set()
+    for i in range(1, segments):
+        target = i * frame_count // segments
+        if keyframes:
+            target = min(keyframes, key=lambda keyframe: abs(keyframe - target))
+        targets.add(target)
+    
+    boundaries = []
+    for boundary in sorted(targets):
+        previous = boundaries[-1] if boundaries else 0
+        if boundary - previous >= MIN_SEGMENT_FRAMES and frame_count - boundary >= MIN_SEGMENT_FRAMES:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def track_segment(video_path, start, end, detector):
+    """Detect the athlete in frames [start, end) of a video; runs in a worker process
+
+    Also decodes frame `end` so the caller can check it against the next
+    segment's first frame.
+    """
+    # Pool processes are forked from the job's process; only count this segment
+    REGISTRY.reset()
+    blobs = []
+    first_digest = boundary_digest = None
+    start_state = detector.state_digest()
+    with FrameSource(video_path) as source:
+        if start:
+            source.seek(start)
+        for frame_number, frame in source:
+            if frame_number == end:
+                boundary_digest = frame_digest(frame)
+                break
+            if frame_number == start:
+                first_digest = frame_digest(frame)
+            blobs.append(detector.detect_frame(frame) if frame_number else [])
+    
+    return {
+        'start': start,
+        'blobs': blobs,
+        'first_digest': first_digest,
+        'boundary_digest': boundary_digest,
+        'start_state': start_state,
+        'end_state': detector.state_digest(),
+        'metrics': REGISTRY.snapshot()
+    }
+
+
+def analyze_video(video_path, target_laps=10, known_distance_meters=20, analysis_mode='accurate',
+                  progress_callback=None, pipeline_workers=PIPELINE_WORKERS, segment_processes=1,
+                  return_track=False, multi_athlete=False, calibration=None, overlay_path=None,
+                  background_learning_rate=BACKGROUND_LEARNING_RATE):
+    """Analyze one video and return a new result dict
+
+    analysis_mode is one of ANALYSIS_MODES and calibration an optional
+    station calibration profile. overlay_path, without an extension, asks
+    for an annotated overlay video to be rendered there. A
+    background_learning_rate of 0 fixes the background, so
+    segment_processes can split the video. Safe to call from many threads or processes
+    at once.
+    """
+    with REGISTRY.timer('analysis'):
+        result = _analyzer.track_athlete_movement(video_path, target_laps, known_distance_meters,
+                                                  progress_callback=progress_callback,
+                                                  pipeline_workers=pipeline_workers,
+                                                  segment_processes=segment_processes,
+                                                  return_track=return_track,
+                                                  multi_athlete=multi_athlete,
+                                                  calibration=calibration,
+                                                  overlay_path=overlay_path,
+                                                  background_learning_rate=background_learning_rate,
+                                                  **ANALYSIS_MODES[analysis_mode])
+    if 'error' not in result:
+        result['analysis_mode'] = analysis_mode
+        result['multi_athlete'] = multi_athlete
+        result['background_learning_rate'] = background_learning_rate
+    return result
+
+
+def reanalyze_track(rows, track_info, target_laps=10, known_distance_meters=20, endpoints=None,
+                    athlete_rows=None):
+    """Redo calibration and lap timing from a saved motion track without decoding"""
+    return _analyzer.reanalyze_track(rows, track_info, target_laps, known_distance_meters, endpoints,
+                                     athlete_rows)
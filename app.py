@@ -1,350 +1,200 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory
 import cv2
-import numpy as np
 import os
 import json
+import functools
+import time
 from datetime import datetime
 import base64
 from werkzeug.utils import secure_filename
 
+from analyzer import (ShuttleRunAnalyzer, analyze_video, analysis_parameters, reanalyze_track, track_covers_endpoints,
+                      tracking_parameters, warm_up as warm_up_analyzer, ANALYSIS_MODES, BACKGROUND_LEARNING_RATE)
+from calibration import ProfileStore, make_profile
+from frame_source import FrameSource, load_frame_index
+from jobs import JobQueue
+from metrics import REGISTRY
+from result_cache import ResultCache, make_cache_key
+from results_store import ResultsStore, import_json_results, labelled_result_id, LABEL_COLUMNS
+from upload_stream import StreamingUploadRequest, remove_stale_uploads
+
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest  # Uploads are written and hashed as they arrive
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['ANALYSIS_WORKERS'] = os.cpu_count() or 1  # Worker processes for video analysis
+app.config['SEGMENT_PROCESSES'] = 1  # Set above 1 to split long videos across processes (fixed backgrounds only)
+app.config['BACKGROUND_LEARNING_RATE'] = BACKGROUND_LEARNING_RATE  # 0 fixes the background, for steady light
+app.config['RESULT_CACHE_FOLDER'] = 'static/results/cache'
+app.config['RESULT_CACHE_MAX_BYTES'] = 50 * 1024 * 1024  # Least recently used results are evicted beyond this
+app.config['CALIBRATION_FOLDER'] = 'calibration_profiles'  # One saved calibration per camera station
+app.config['RESULTS_DATABASE'] = 'static/results/results.db'  # Every result, for listing and leaderboards
+app.config['OVERLAY_FOLDER'] = 'static/results/overlays'  # Annotated overlay videos and their thumbnails
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/results', exist_ok=True)
+os.makedirs(app.config['OVERLAY_FOLDER'], exist_ok=True)
+remove_stale_uploads(app.config['UPLOAD_FOLDER'])
 
-class ShuttleRunAnalyzer:
-    def __init__(self):
-        self.endpoints = []
-        self.lap_times = []
-        self.total_laps = 0
-        self.distance = 0
-        self.distance_pixels = 0
-        self.distance_meters = 0
-        self.pixels_per_meter = 0
-        
-    def detect_endpoints(self, frame):
-        """Detect endpoints using color detection or manual selection"""
-        # Convert to HSV for better color detection
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # Define range for red color (common for cones/markers)
-        lower_red = np.array([0, 50, 50])
-        upper_red = np.array([10, 255, 255])
-        
-        # Create mask for red color
-        mask = cv2.inRange(hsv, lower_red, upper_red)
-        
-        # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        endpoints = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > 100:  # Filter small contours
-                # Get bounding rectangle
-                x, y, w, h = cv2.boundingRect(contour)
-                center_x = x + w // 2
-                center_y = y + h // 2
-                endpoints.append((center_x, center_y))
-        
-        return endpoints
+job_queue = JobQueue(max_workers=app.config['ANALYSIS_WORKERS'])
+# Seconds spent getting ready to serve (import_seconds, warmup_seconds,
+# ready_seconds) and on the first request, exported by /metrics
+startup_timings = {}
+result_cache = ResultCache(app.config['RESULT_CACHE_FOLDER'], app.config['RESULT_CACHE_MAX_BYTES'])
+calibration_profiles = ProfileStore(app.config['CALIBRATION_FOLDER'])
+results_store = ResultsStore(app.config['RESULTS_DATABASE'])
+
+# Results saved as JSON files before the results store existed are imported once
+if results_store.get_meta('json_imported') is None:
+    print(f"Imported {import_json_results(results_store, 'static/results')} earlier result(s) into the results store")
+    results_store.set_meta('json_imported', datetime.now().isoformat())
+
+def warm_up():
+    """Run the analysis code once here and start every analysis worker before taking traffic
     
-    def calculate_distance(self, point1, point2):
-        """Calculate Euclidean distance between two points in pixels"""
-        return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
+    The workers are forked from this process, so they start with the heavy
+    modules already imported and also run the warm-up once.
+    """
+    started = time.perf_counter()
+    warm_up_analyzer()
+    job_queue.warm_up(warm_up_analyzer)
+    # Leave the warm-up's synthetic frames out of the stage timings
+    REGISTRY.reset()
+    startup_timings['warmup_seconds'] = time.perf_counter() - started
+    print(f"Warmed up in {startup_timings['warmup_seconds']:.3f}s with {job_queue.max_workers} analysis worker(s)")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_first_request(response):
+    """Record how long the first request to this process took"""
+    if 'first_request_seconds' not in startup_timings and 'request_started' in g:
+        seconds = startup_timings.setdefault('first_request_seconds', time.perf_counter() - g.request_started)
+        print(f"First request ({request.path}) took {seconds:.3f}s")
+    return response
+
+def stored_video_name(video_hash, filename):
+    """Name an upload is stored under in the upload folder: its content hash and the original extension"""
+    return video_hash + os.path.splitext(filename)[1].lower()
+
+def find_upload(name):
+    """Path of an uploaded video from its stored name (video_file) or the filename it was last analysed as
     
-    def calibrate_distance(self, known_distance_meters=20):
-        """Calibrate pixel to meter conversion using standard shuttle run distance"""
-        # Standard shuttle run distance is 20 meters (10 meters each way)
-        if self.distance_pixels > 0:
-            self.pixels_per_meter = self.distance_pixels / known_distance_meters
-            self.distance_meters = self.distance_pixels / self.pixels_per_meter
-            return self.distance_meters
-        return 0
+    Returns None if there is no such video.
+    """
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(name))
+    if os.path.isfile(filepath):
+        return filepath
+    result = results_store.get_by_filename(secure_filename(name))
+    if result and result.get('video_hash'):
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], stored_video_name(result['video_hash'], name))
+        if os.path.isfile(filepath):
+            return filepath
+    return None
+
+def save_results(filename, video_hash, cache_key, result, labels=None):
+    """Store a finished analysis with its upload metadata in the result cache and results store
     
-    def calculate_actual_distance_from_video(self, video_path):
-        """Calculate actual distance by analyzing video content and known reference objects"""
-        try:
-            cap = cv2.VideoCapture(video_path)
-            if not cap.isOpened():
-                return None
-            
-            # Get first frame
-            ret, frame = cap.read()
-            if not ret:
-                cap.release()
-                return None
-            
-            # Try to detect reference objects or use video dimensions for estimation
-            height, width = frame.shape[:2]
-            
-            # Method 1: Try to detect human figure for scale reference
-            # Average human height is ~1.7m, we can use this as reference
-            human_height_pixels = self.detect_human_height(frame)
-            
-            if human_height_pixels > 0:
-                # Use human height as reference (average 1.7m)
-                pixels_per_meter = human_height_pixels / 1.7
-                actual_distance = self.distance_pixels / pixels_per_meter
-                cap.release()
-                return actual_distance
-            
-            # Method 2: Use video field of view estimation
-            # This is a rough estimation based on typical camera angles
-            # For a standard phone camera at 1.5m height, 2m distance from track
-            estimated_pixels_per_meter = width / 15  # Rough estimation for typical setup
-            actual_distance = self.distance_pixels / estimated_pixels_per_meter
-            
-            cap.release()
-            return actual_distance
-            
-        except Exception as e:
-            print(f"Error calculating actual distance: {str(e)}")
-            return None
+    labels are the athlete and session the upload was tagged with; each set
+    of labels is stored as a result of its own. A motion
+    track returned with the result is stored separately so the video can be
+    reanalyzed with other settings without decoding it again.
+    """
+    result = {key: value for key, value in result.items() if key not in LABEL_COLUMNS}
+    track = result.pop('track', None)
+    track_info = result.pop('track_info', None)
+    athlete_track = result.pop('athlete_track', None)
+    if track is not None:
+        tracking_key = make_cache_key(video_hash, tracking_parameters(result['analysis_mode'],
+                                                                      result['multi_athlete'],
+                                                                      result.get('calibration'),
+                                                                      result.get('background_learning_rate',
+                                                                                 BACKGROUND_LEARNING_RATE)))
+        result_cache.put_track(tracking_key, track, track_info, athlete_track)
     
-    def detect_human_height(self, frame):
-        """Detect human figure and estimate height in pixels"""
-        try:
-            # Convert to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Use background subtraction to find moving objects
-            # This is a simplified approach - in practice, you'd use more sophisticated methods
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            
-            # Create mask for skin color detection (simplified)
-            lower_skin = np.array([0, 20, 70], dtype=np.uint8)
-            upper_skin = np.array([20, 255, 255], dtype=np.uint8)
-            mask = cv2.inRange(hsv, lower_skin, upper_skin)
-            
-            # Find contours
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if contours:
-                # Get largest contour (likely the person)
-                largest_contour = max(contours, key=cv2.contourArea)
-                if cv2.contourArea(largest_contour) > 1000:  # Filter small detections
-                    x, y, w, h = cv2.boundingRect(largest_contour)
-                    return h  # Return height in pixels
-            
-            return 0
-            
-        except Exception as e:
-            print(f"Error detecting human height: {str(e)}")
-            return 0
+    result.update(video_filename=filename, video_file=stored_video_name(video_hash, filename),
+                  video_hash=video_hash, result_id=labelled_result_id(cache_key, labels),
+                  timestamp=datetime.now().isoformat(), **(labels or {}))
+    overlay = result.get('overlay')
+    overlay_files = []
+    if overlay and 'file' in overlay:
+        result['overlay'] = dict(overlay, url=f"/overlays/{overlay['file']}",
+                                 thumbnail_url=f"/overlays/{overlay['thumbnail']}" if overlay['thumbnail'] else None)
+        # Counted against the cache's size budget and evicted with the result
+        overlay_files = [os.path.join(app.config['OVERLAY_FOLDER'], name)
+                         for name in (overlay['file'], overlay['thumbnail']) if name]
+    with REGISTRY.timer('result_write'):
+        result_cache.put(cache_key, result, filename, overlay_files)
+        results_store.put(result)
     
-    def track_athlete_movement(self, video_path, target_laps=10, known_distance_meters=20):
-        """Process video to track athlete movement and calculate lap times"""
-        try:
-            print(f"Opening video: {video_path}")
-            cap = cv2.VideoCapture(video_path)
-            
-            if not cap.isOpened():
-                print("Error: Could not open video file")
-                return {"error": "Could not open video file"}
-            
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps
-            
-            print(f"Video info - FPS: {fps}, Frames: {frame_count}, Duration: {duration:.2f}s")
-            
-            # Get first frame to detect endpoints
-            ret, first_frame = cap.read()
-            if not ret:
-                print("Error: Could not read first frame")
-                return {"error": "Could not read video"}
-            
-            print("Detecting endpoints...")
-            # Detect endpoints in first frame
-            self.endpoints = self.detect_endpoints(first_frame)
-            print(f"Detected {len(self.endpoints)} endpoints: {self.endpoints}")
-            
-            if len(self.endpoints) < 2:
-                print("Warning: Could not detect at least 2 endpoints")
-                # For testing, create dummy endpoints if none detected
-                if len(self.endpoints) == 0:
-                    h, w = first_frame.shape[:2]
-                    self.endpoints = [(w//4, h//2), (3*w//4, h//2)]
-                    print(f"Using dummy endpoints: {self.endpoints}")
-                else:
-                    return {"error": "Could not detect at least 2 endpoints. Please ensure red markers are visible."}
-            
-            # Calculate distance between endpoints
-            self.distance_pixels = self.calculate_distance(self.endpoints[0], self.endpoints[1])
-            self.distance = self.distance_pixels  # Keep for backward compatibility
-            
-            # Calculate actual distance from video analysis
-            print("Calculating actual distance from video analysis...")
-            actual_distance_from_video = self.calculate_actual_distance_from_video(video_path)
-            
-            if actual_distance_from_video:
-                print(f"Actual distance calculated from video: {actual_distance_from_video:.2f} meters")
-                
-                # Compare with entered distance
-                difference = abs(actual_distance_from_video - known_distance_meters)
-                accuracy_percentage = (1 - difference / known_distance_meters) * 100
-                
-                print(f"Entered distance: {known_distance_meters:.2f} meters")
-                print(f"Calculated distance: {actual_distance_from_video:.2f} meters")
-                print(f"Difference: {difference:.2f} meters")
-                print(f"Accuracy: {accuracy_percentage:.1f}%")
-                
-                # Use the calculated distance for calibration if it's reasonable
-                if accuracy_percentage > 70:  # If accuracy is good, use calculated distance
-                    print("Using calculated distance for calibration (good accuracy)")
-                    self.distance_meters = actual_distance_from_video
-                    self.pixels_per_meter = self.distance_pixels / actual_distance_from_video
-                else:
-                    print("Using entered distance for calibration (calculated distance seems inaccurate)")
-                    self.distance_meters = self.calibrate_distance(known_distance_meters)
-            else:
-                print("Could not calculate actual distance from video, using entered distance")
-                self.distance_meters = self.calibrate_distance(known_distance_meters)
-            
-            print(f"Final distance: {self.distance_meters:.2f} meters")
-            print(f"Calibration: {self.pixels_per_meter:.2f} pixels per meter")
-            
-            # Reset video to beginning
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            
-            # Track athlete position
-            athlete_positions = []
-            current_lap = 0
-            lap_start_time = 0
-            last_position = None
-            direction = 1  # 1 for moving towards endpoint 1, -1 for endpoint 2
-            
-            frame_number = 0
-            processed_frames = 0
-            
-            print("Starting athlete tracking...")
-            
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                current_time = frame_number / fps
-                
-                # Simple athlete detection (you can improve this with more sophisticated methods)
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                
-                # Use background subtraction for better athlete detection
-                if frame_number == 0:
-                    background = gray.copy()
-                else:
-                    diff = cv2.absdiff(background, gray)
-                    _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-                    
-                    # Find contours to detect athlete
-                    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    
-                    if contours:
-                        # Get largest contour (likely the athlete)
-                        largest_contour = max(contours, key=cv2.contourArea)
-                        if cv2.contourArea(largest_contour) > 500:  # Filter small movements
-                            M = cv2.moments(largest_contour)
-                            if M["m00"] != 0:
-                                cx = int(M["m10"] / M["m00"])
-                                cy = int(M["m01"] / M["m00"])
-                                athlete_positions.append((cx, cy, current_time))
-                                
-                                # Check for lap completion
-                                if last_position is not None:
-                                    # Check if athlete crossed the line between endpoints
-                                    if self.check_lap_completion(last_position, (cx, cy)):
-                                        if current_lap == 0:
-                                            lap_start_time = current_time
-                                        else:
-                                            lap_time = current_time - lap_start_time
-                                            self.lap_times.append(lap_time)
-                                            lap_start_time = current_time
-                                        
-                                        current_lap += 1
-                                        print(f"Lap {current_lap} completed at {current_time:.2f}s")
-                                        if current_lap >= target_laps:
-                                            break
-                                    
-                                    last_position = (cx, cy)
-                                else:
-                                    last_position = (cx, cy)
-                
-                frame_number += 1
-                processed_frames += 1
-                
-                # Progress update every 100 frames
-                if processed_frames % 100 == 0:
-                    print(f"Processed {processed_frames} frames...")
-            
-            cap.release()
-            print(f"Video processing completed. Processed {processed_frames} frames")
-            
-            # Calculate final lap time if athlete didn't complete all laps
-            if current_lap < target_laps and lap_start_time > 0:
-                final_lap_time = duration - lap_start_time
-                self.lap_times.append(final_lap_time)
-                current_lap += 1
-            
-            self.total_laps = current_lap
-            
-            print(f"Final results - Laps: {self.total_laps}/{target_laps}, Lap times: {self.lap_times}")
-            
-            # Prepare comparison data
-            comparison_data = {}
-            if actual_distance_from_video:
-                difference = abs(actual_distance_from_video - known_distance_meters)
-                accuracy_percentage = (1 - difference / known_distance_meters) * 100
-                comparison_data = {
-                    "entered_distance": known_distance_meters,
-                    "calculated_distance": actual_distance_from_video,
-                    "difference": difference,
-                    "accuracy_percentage": accuracy_percentage,
-                    "calibration_method": "calculated" if accuracy_percentage > 70 else "entered"
-                }
-            
-            return {
-                "total_laps": self.total_laps,
-                "target_laps": target_laps,
-                "lap_times": self.lap_times,
-                "distance_pixels": self.distance_pixels,
-                "distance_meters": self.distance_meters,
-                "distance": self.distance_meters,  # Main distance in meters
-                "pixels_per_meter": self.pixels_per_meter,
-                "endpoints": self.endpoints,
-                "duration": duration,
-                "processed_frames": processed_frames,
-                "distance_comparison": comparison_data
-            }
-            
-        except Exception as e:
-            print(f"Error in track_athlete_movement: {str(e)}")
-            return {"error": f"Video processing error: {str(e)}"}
+    print(f"Processing completed successfully for {filename}")
+    return result
+
+def reanalyze_from_track(video_hash, analysis_mode, target_laps, known_distance, endpoints=None,
+                         multi_athlete=False, calibration=None, background_learning_rate=BACKGROUND_LEARNING_RATE):
+    """Analyze a video again from its stored motion track, or return None if there is no usable track"""
+    tracking_key = make_cache_key(video_hash, tracking_parameters(analysis_mode, multi_athlete, calibration,
+                                                                  background_learning_rate))
+    stored = result_cache.get_track(tracking_key)
+    if stored is None:
+        return None
+    rows, track_info, athlete_rows = stored
     
-    def check_lap_completion(self, pos1, pos2):
-        """Check if athlete crossed the line between endpoints"""
-        # Simple heuristic: check if athlete moved from one side to the other
-        # This is a simplified version - you can improve this logic
-        if len(self.endpoints) >= 2:
-            endpoint1, endpoint2 = self.endpoints[0], self.endpoints[1]
-            
-            # Calculate which side of the line each position is on
-            def point_side(point, line_start, line_end):
-                return ((line_end[0] - line_start[0]) * (point[1] - line_start[1]) - 
-                       (line_end[1] - line_start[1]) * (point[0] - line_start[0]))
-            
-            side1 = point_side(pos1, endpoint1, endpoint2)
-            side2 = point_side(pos2, endpoint1, endpoint2)
-            
-            # If signs are different, athlete crossed the line
-            return (side1 * side2) < 0
-        
-        return False
+    # Motion was only tracked in the lane around the original endpoints
+    if endpoints and endpoints != track_info['endpoints'] and not track_covers_endpoints(track_info, endpoints):
+        return None
+    
+    # Tracking stops once the original lap target is reached, so a stopped
+    # track cannot answer for more laps or for a different line
+    if not track_info['complete']:
+        if target_laps > track_info['target_laps'] or (endpoints and endpoints != track_info['endpoints']):
+            return None
+    
+    result = reanalyze_track(rows, track_info, target_laps, known_distance, endpoints, athlete_rows)
+    result.update(analysis_mode=analysis_mode, multi_athlete=multi_athlete,
+                  background_learning_rate=background_learning_rate)
+    return result
+
+def remember_cache_hit(filename, cache_key, cached, labels):
+    """Record a cached result under the filename and labels it was uploaded with again"""
+    result_cache.link_filename(filename, cache_key)
+    result_id = labelled_result_id(cache_key, labels)
+    result = {key: value for key, value in (results_store.get(result_id) or cached).items()
+              if key not in LABEL_COLUMNS}
+    result.update(video_filename=filename, video_file=stored_video_name(cached['video_hash'], filename),
+                  result_id=result_id, **labels)
+    results_store.put(result)
+    return result
+
+def form_labels():
+    """The athlete and session an upload is tagged with, if any"""
+    labels = {}
+    for name in LABEL_COLUMNS:
+        value = request.form.get(name, '').strip()
+        if value:
+            labels[name] = value
+    return labels
 
-analyzer = ShuttleRunAnalyzer()
+def overlay_missing(result):
+    """True if a result's overlay video has been deleted since it was rendered"""
+    overlay = result.get('overlay') or {}
+    return 'file' in overlay and not os.path.isfile(os.path.join(app.config['OVERLAY_FOLDER'], overlay['file']))
+
+def form_flag(name):
+    """True if a checkbox-style form field is set"""
+    return request.form.get(name, '').lower() in ('1', 'true', 'on')
+
+def parse_endpoints(value):
+    """Parse an endpoints form field like "[[x1, y1], [x2, y2]]", raising ValueError if invalid"""
+    endpoints = json.loads(value)
+    if (not isinstance(endpoints, list) or len(endpoints) != 2 or
+            not all(isinstance(point, list) and len(point) == 2 and
+                    all(isinstance(value, (int, float)) for value in point) for point in endpoints)):
+        raise ValueError('endpoints must be two [x, y] points')
+    return endpoints
 
 @app.route('/')
 def index():
@@ -353,47 +203,131 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_video():
     try:
-        if 'video' not in request.files:
+        # Reading the form streams the upload to disk
+        with REGISTRY.timer('upload_receive'):
+            files = request.files
+        if 'video' not in files:
             return jsonify({'error': 'No video file provided'}), 400
         
-        file = request.files['video']
+        file = files['video']
         if file.filename == '':
             return jsonify({'error': 'No video file selected'}), 400
         
         if file and file.filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            
+            # The upload has already been streamed into the upload folder and
+            # hashed; it only needs renaming into place. It is stored under its
+            # hash, so a different clip uploaded with the same name can never
+            # replace it while its analysis is queued.
+            video_hash = file.stream.hexdigest()
+            video_file = stored_video_name(video_hash, filename)
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], video_file)
+            with REGISTRY.timer('upload_commit'):
+                if os.path.isfile(filepath):
+                    # Same bytes as an earlier upload, which may be being analysed
+                    file.stream.close()
+                else:
+                    file.stream.commit(filepath)
+            REGISTRY.increment('uploads_total')
             
             # Verify file was saved
             if not os.path.exists(filepath):
                 return jsonify({'error': 'Failed to save video file'}), 500
             
+            # Index the keyframes once, so analysis and frame requests can seek exactly
+            with REGISTRY.timer('frame_index'):
+                load_frame_index(filepath)
+            
             # Get target laps and known distance from form
             target_laps = int(request.form.get('target_laps', 10))
             known_distance = float(request.form.get('known_distance', 20))
-            
-            print(f"Processing video: {filename}")
+            analysis_mode = request.form.get('analysis_mode', 'accurate')
+            multi_athlete = form_flag('multi_athlete')
+            profile = form_flag('profile')
+            overlay = form_flag('overlay')
+            labels = form_labels()
+            learning_rate = app.config['BACKGROUND_LEARNING_RATE']
+            if analysis_mode not in ANALYSIS_MODES:
+                return jsonify({'error': f'Invalid analysis mode. Choose one of: {", ".join(ANALYSIS_MODES)}'}), 400
+            
+            # A fixed camera station's saved calibration replaces endpoint and scale detection
+            station_id = request.form.get('station_id', '').strip()
+            calibration = None
+            if station_id:
+                calibration = calibration_profiles.get(station_id)
+                if calibration is None:
+                    return jsonify({'error': f'No calibration profile for station {station_id}'}), 404
+            
+            print(f"Processing video: {filename} (stored as {video_file})")
             print(f"File size: {os.path.getsize(filepath)} bytes")
             print(f"Target laps: {target_laps}")
             print(f"Known distance: {known_distance} meters")
-            
-            # Process video
-            result = analyzer.track_athlete_movement(filepath, target_laps, known_distance)
-            
-            # Check if processing was successful
-            if 'error' in result:
-                return jsonify(result), 400
-            
-            # Save results
-            result['video_filename'] = filename
-            result['timestamp'] = datetime.now().isoformat()
-            
-            with open(f'static/results/{filename}_results.json', 'w') as f:
-                json.dump(result, f, indent=2)
-            
-            print(f"Processing completed successfully for {filename}")
-            return jsonify(result)
+            print(f"Analysis mode: {analysis_mode}")
+            print(f"Track every athlete: {multi_athlete}")
+            print(f"Calibration station: {station_id or 'none'}")
+            print(f"Overlay video: {overlay}")
+            
+            # Same video bytes and settings as an earlier upload: answer from the cache
+            parameters = analysis_parameters(target_laps, known_distance, analysis_mode,
+                                             multi_athlete=multi_athlete, calibration=calibration, overlay=overlay,
+                                             background_learning_rate=learning_rate)
+            cache_key = make_cache_key(video_hash, parameters)
+            with REGISTRY.timer('cache_lookup'):
+                cached = result_cache.get(cache_key)
+            if cached is not None and not overlay_missing(cached):
+                print(f"Returning cached results for {filename}")
+                REGISTRY.increment('cache_hits_total')
+                return jsonify(dict(remember_cache_hit(filename, cache_key, cached, labels), cached=True))
+            
+            # Same video tracked before with other lap or distance settings:
+            # recompute from the stored motion track instead of decoding. An
+            # overlay needs the frames, so it always decodes.
+            result = None
+            if not overlay:
+                result = reanalyze_from_track(video_hash, analysis_mode, target_laps, known_distance,
+                                              multi_athlete=multi_athlete, calibration=calibration,
+                                              background_learning_rate=learning_rate)
+            if result is not None:
+                print(f"Reanalyzing {filename} from its stored motion track")
+                REGISTRY.increment('reanalyses_total')
+                return jsonify(dict(save_results(filename, video_hash, cache_key, result, labels),
+                                    reanalyzed=True))
+            
+            # The same analysis may already be queued from another upload,
+            # unless this one asks for its own profile; this upload's result
+            # is then saved under its own filename and labels when it finishes
+            job_id = None
+            if not profile:
+                job_id = job_queue.join_active(functools.partial(save_results, filename, video_hash, cache_key,
+                                                                 labels=labels),
+                                               cache_key=cache_key)
+            if job_id is None:
+                # Queue the analysis and return straight away; the page polls /jobs/<id>
+                job_id = job_queue.submit(analyze_video, filepath, target_laps, known_distance, analysis_mode,
+                                          segment_processes=app.config['SEGMENT_PROCESSES'],
+                                          return_track=True,
+                                          multi_athlete=multi_athlete,
+                                          calibration=calibration,
+                                          overlay_path=(os.path.join(app.config['OVERLAY_FOLDER'], cache_key)
+                                                        if overlay else None),
+                                          background_learning_rate=learning_rate,
+                                          profile=profile,
+                                          on_complete=functools.partial(save_results, filename, video_hash,
+                                                                        cache_key, labels=labels),
+                                          metadata={'video_filename': filename, 'video_file': video_file,
+                                                    'cache_key': cache_key})
+                print(f"Queued job {job_id} for {filename}")
+            
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'video_filename': filename,
+                'video_file': video_file,
+                'status_url': f'/jobs/{job_id}',
+                'result_url': f'/jobs/{job_id}/result',
+                'events_url': f'/jobs/{job_id}/events'
+            }), 202
         
         return jsonify({'error': 'Invalid file format. Please upload MP4, AVI, MOV, or MKV files.'}), 400
     
@@ -401,14 +335,255 @@ def upload_video():
         print(f"Error in upload_video: {str(e)}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/reanalyze/<result_id>', methods=['POST'])
+def reanalyze_result(result_id):
+    """Recompute a result with new lap, distance or endpoint settings from its stored motion track"""
+    try:
+        original = results_store.get(result_id)
+        if original is None or 'video_hash' not in original:
+            return jsonify({'error': 'Result not found'}), 404
+        
+        filename = original['video_filename']
+        video_hash = original['video_hash']
+        analysis_mode = original.get('analysis_mode', 'accurate')
+        multi_athlete = original.get('multi_athlete', False)
+        calibration = original.get('calibration')
+        learning_rate = original.get('background_learning_rate', BACKGROUND_LEARNING_RATE)
+        labels = {name: original[name] for name in LABEL_COLUMNS if original.get(name)}
+        try:
+            target_laps = int(request.form.get('target_laps', 10))
+            known_distance = float(request.form.get('known_distance', 20))
+            endpoints = parse_endpoints(request.form['endpoints']) if request.form.get('endpoints') else None
+        except ValueError as e:
+            return jsonify({'error': f'Invalid reanalysis settings: {str(e)}'}), 400
+        
+        parameters = analysis_parameters(target_laps, known_distance, analysis_mode, endpoints, multi_athlete,
+                                         calibration, background_learning_rate=learning_rate)
+        cache_key = make_cache_key(video_hash, parameters)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(dict(remember_cache_hit(filename, cache_key, cached, labels), cached=True))
+        
+        result = reanalyze_from_track(video_hash, analysis_mode, target_laps, known_distance, endpoints,
+                                      multi_athlete, calibration, learning_rate)
+        if result is None:
+            return jsonify({'error': 'No stored motion track covers these settings. Upload the video again to re-run tracking.'}), 409
+        
+        print(f"Reanalyzed {filename} from its stored motion track")
+        REGISTRY.increment('reanalyses_total')
+        return jsonify(dict(save_results(filename, video_hash, cache_key, result, labels), reanalyzed=True))
+    
+    except Exception as e:
+        print(f"Error in reanalyze_result: {str(e)}")
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/calibration')
+def list_calibration_profiles():
+    """Every saved station calibration"""
+    return jsonify({'profiles': calibration_profiles.list()})
+
+@app.route('/calibration/<station_id>', methods=['GET'])
+def get_calibration_profile(station_id):
+    profile = calibration_profiles.get(station_id)
+    if profile is None:
+        return jsonify({'error': 'Calibration profile not found'}), 404
+    return jsonify({key: value for key, value in profile.items() if key != 'markers'})
+
+@app.route('/calibration/<station_id>', methods=['PUT', 'POST'])
+def save_calibration_profile(station_id):
+    """Calibrate a station from the first frame of an uploaded video
+    
+    Form fields: video (an upload's video_file, or the filename it was
+    analysed as), and either known_distance
+    (meters between the endpoints) or homography (a 3x3 image-to-ground
+    matrix in meters, as JSON). endpoints ("[[x1, y1], [x2, y2]]") default to
+    the red markers detected in the frame.
+    """
+    try:
+        filepath = find_upload(request.form.get('video', ''))
+        if filepath is None:
+            return jsonify({'error': 'Video not found. Upload it first, then calibrate from it.'}), 404
+        
+        with FrameSource(filepath) as source:
+            frame = source.first_frame
+        if frame is None:
+            return jsonify({'error': 'Could not read video'}), 400
+        
+        try:
+            if request.form.get('endpoints'):
+                endpoints = parse_endpoints(request.form['endpoints'])
+            else:
+                endpoints = ShuttleRunAnalyzer().detect_endpoints(frame)
+                if len(endpoints) < 2:
+                    return jsonify({'error': 'Could not detect at least 2 endpoints. Give them as endpoints.'}), 400
+            homography = json.loads(request.form['homography']) if request.form.get('homography') else None
+            known_distance = float(request.form['known_distance']) if request.form.get('known_distance') else None
+            profile = make_profile(station_id, frame, endpoints, known_distance, homography)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Invalid calibration: {str(e)}'}), 400
+        
+        calibration_profiles.put(profile)
+        print(f"Saved calibration for station {station_id}: {profile['pixels_per_meter']:.2f} pixels per meter")
+        return jsonify({key: value for key, value in profile.items() if key != 'markers'})
+    
+    except Exception as e:
+        print(f"Error in save_calibration_profile: {str(e)}")
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/calibration/<station_id>', methods=['DELETE'])
+def delete_calibration_profile(station_id):
+    if not calibration_profiles.delete(station_id):
+        return jsonify({'error': 'Calibration profile not found'}), 404
+    return jsonify({'deleted': station_id})
+
+@app.route('/results')
+def list_results():
+    """One page of result summaries, newest first, optionally filtered
+    
+    Query parameters: athlete, session, station_id, video_hash,
+    video_filename, since and until (ISO timestamps), limit, and cursor (the
+    next_cursor of the previous page).
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    results, next_cursor = results_store.list(request.args, limit, request.args.get('cursor'))
+    return jsonify({'results': results, 'next_cursor': next_cursor})
+
+@app.route('/results/aggregates')
+def aggregate_results():
+    """Leaderboard grouped by athlete, session, station_id or video_hash, filtered like /results"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        groups = results_store.aggregate(request.args.get('group_by', 'athlete'), request.args, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'group_by': request.args.get('group_by', 'athlete'), 'groups': groups})
+
 @app.route('/results/<filename>')
 def get_results(filename):
-    results_file = f'static/results/{filename}_results.json'
-    if os.path.exists(results_file):
-        with open(results_file, 'r') as f:
-            return jsonify(json.load(f))
+    result = results_store.get_by_filename(filename)
+    if result is not None:
+        return jsonify(result)
     return jsonify({'error': 'Results not found'}), 404
 
+@app.route('/videos/<filename>/frames/<int:frame_number>')
+def get_video_frame(filename, frame_number):
+    """One decoded frame of an uploaded video, by video_file or analysed filename, as a JPEG"""
+    filepath = find_upload(filename)
+    if filepath is None:
+        return jsonify({'error': 'Video not found'}), 404
+    
+    with REGISTRY.timer('frame_access'):
+        with FrameSource(filepath, load_frame_index(filepath)) as source:
+            frame = source.read_frame(frame_number)
+    if frame is None:
+        return jsonify({'error': 'Frame not found'}), 404
+    
+    ok, jpeg = cv2.imencode('.jpg', frame)
+    if not ok:
+        return jsonify({'error': 'Could not encode frame'}), 500
+    return Response(jpeg.tobytes(), mimetype='image/jpeg')
+
+@app.route('/overlays/<filename>')
+def get_overlay(filename):
+    """An overlay video or thumbnail, streamed from disk with HTTP range support"""
+    filename = secure_filename(filename)
+    if not os.path.isfile(os.path.join(app.config['OVERLAY_FOLDER'], filename)):
+        return jsonify({'error': 'Overlay not found'}), 404
+    # Answers Range requests with 206 partial content, so players can seek
+    return send_from_directory(os.path.abspath(app.config['OVERLAY_FOLDER']), filename, conditional=True)
+
+def add_progress_percent(job):
+    """Fill in progress['percent'] for a job record returned by the queue"""
+    progress = job['progress']
+    if progress.get('total_frames'):
+        progress['percent'] = min(100.0, 100.0 * progress['processed_frames'] / progress['total_frames'])
+    if job['status'] == 'completed':
+        progress['percent'] = 100.0
+    return job
+
+def server_sent_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(add_progress_percent(job))
+
+@app.route('/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    """Server-Sent Events stream of a job's progress, laps and final result"""
+    if job_queue.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        version = None
+        sent_laps = 0
+        while True:
+            job = job_queue.wait_for_update(job_id, version, timeout=15)
+            if job is None:
+                yield server_sent_event('failed', {'error': 'Job expired'})
+                return
+            if job['version'] == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = job['version']
+            
+            # Laps are sent once each; a reconnecting client gets them all again
+            for lap in job['laps'][sent_laps:]:
+                yield server_sent_event('lap', lap)
+            sent_laps = len(job['laps'])
+            
+            yield server_sent_event('progress', dict(add_progress_percent(job)['progress'], status=job['status']))
+            
+            if job['status'] == 'completed':
+                yield server_sent_event('result', job_queue.get_result(job_id))
+                return
+            if job['status'] == 'failed':
+                yield server_sent_event('failed', {'error': job['error']})
+                return
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'failed':
+        return jsonify(job_queue.get_result(job_id)), 400
+    if job['status'] != 'completed':
+        return jsonify({'job_id': job_id, 'status': job['status']}), 202
+    return jsonify(job_queue.get_result(job_id))
+
+@app.route('/jobs/<job_id>/profile')
+def get_job_profile(job_id):
+    """cProfile report of a job uploaded with profile=1"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] in ('queued', 'running'):
+        return jsonify({'job_id': job_id, 'status': job['status']}), 202
+    
+    report = job_queue.get_profile(job_id)
+    if report is None:
+        return jsonify({'error': 'Job was not profiled'}), 404
+    return Response(report, mimetype='text/plain')
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings and counters in the Prometheus text format"""
+    gauges = {'queue_depth': job_queue.queue_depth(), 'analysis_workers': job_queue.max_workers}
+    gauges.update(startup_timings)
+    return Response(REGISTRY.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test')
 def test_endpoint():
     """Test endpoint to verify system is working"""
@@ -416,7 +591,9 @@ def test_endpoint():
         'status': 'OK',
         'message': 'Shuttle Run Assessment System is running',
         'upload_folder': app.config['UPLOAD_FOLDER'],
-        'max_file_size': app.config['MAX_CONTENT_LENGTH']
+        'max_file_size': app.config['MAX_CONTENT_LENGTH'],
+        'analysis_workers': job_queue.max_workers,
+        'queue_depth': job_queue.queue_depth()
     })
 
 if __name__ == '__main__':
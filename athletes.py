@@ -0,0 +1,137 @@
+"""Tracking several athletes at once with persistent IDs.
+
+Every moving blob in a frame is matched to the predicted position of an
+athlete seen in earlier frames, nearest pairs first, and unmatched blobs
+start new athletes. Each athlete gets its own centroid track, so a whole
+class running side by side is counted and timed from a single decode pass.
+"""
+
+import numpy as np
+
+from laps import AREA, FRAME, TIME, X, Y, find_line_crossings, lap_results, last_lap_unfinished
+
+# Column of the athlete ID in a combined athlete track, after the
+# CentroidTrack columns
+ATHLETE = AREA + 1
+
+# Farthest an athlete can be from its predicted position and still be
+# matched, as a fraction of the distance between the endpoints
+MAX_MATCH_DISTANCE = 0.15
+
+# Frames an athlete can go undetected before its ID is retired
+MAX_MISSED_FRAMES = 15
+
+# Athletes seen in fewer frames than this are taken to be noise
+MIN_ATHLETE_FRAMES = 15
+
+
+def match_nearest(predicted, detected, max_distance):
+    """Pair rows of predicted and detected (x, y) positions, nearest pairs first
+
+    Returns (predicted_indices, detected_indices) of the pairs closer than
+    max_distance; every row is used at most once.
+    """
+    if len(predicted) == 0 or len(detected) == 0:
+        return [], []
+    distances = np.hypot(predicted[:, None, 0] - detected[None, :, 0],
+                         predicted[:, None, 1] - detected[None, :, 1])
+    used_predicted = np.zeros(len(predicted), dtype=bool)
+    used_detected = np.zeros(len(detected), dtype=bool)
+    pairs = ([], [])
+    for flat in np.argsort(distances, axis=None):
+        i, j = divmod(int(flat), len(detected))
+        if distances[i, j] > max_distance:
+            break
+        if used_predicted[i] or used_detected[j]:
+            continue
+        used_predicted[i] = used_detected[j] = True
+        pairs[0].append(i)
+        pairs[1].append(j)
+    return pairs
+
+
+class AthleteTracker:
+    """Assigns stable IDs to the moving blobs of consecutive frames"""
+
+    def __init__(self, max_distance, max_missed_frames=MAX_MISSED_FRAMES, capacity=1024):
+        self.max_distance = max_distance
+        self.max_missed_frames = max_missed_frames
+        self._next_id = 1
+        # One entry per athlete that has not been retired
+        self._ids = np.empty(0, dtype=np.int64)
+        self._positions = np.empty((0, 2))
+        self._velocities = np.empty((0, 2))  # Pixels per frame
+        self._last_frames = np.empty(0)
+        self._rows = np.empty((max(capacity, 1), ATHLETE + 1))
+        self._length = 0
+
+    def update(self, frame_number, time, blobs):
+        """Match one frame's blobs, given as (cx, cy, area) tuples, to athletes and record them"""
+        blobs = np.asarray(blobs, dtype=np.float64).reshape(-1, 3)
+
+        active = frame_number - self._last_frames <= self.max_missed_frames
+        self._ids, self._positions = self._ids[active], self._positions[active]
+        self._velocities, self._last_frames = self._velocities[active], self._last_frames[active]
+
+        # Constant-velocity prediction over however many frames were missed or skipped
+        gaps = frame_number - self._last_frames
+        predicted = self._positions + self._velocities * gaps[:, None]
+        tracked, detected = match_nearest(predicted, blobs[:, :2], self.max_distance)
+
+        if tracked:
+            tracked, detected = np.array(tracked), np.array(detected)
+            step = (blobs[detected, :2] - self._positions[tracked]) / gaps[tracked, None]
+            self._velocities[tracked] = 0.5 * self._velocities[tracked] + 0.5 * step
+            self._positions[tracked] = blobs[detected, :2]
+            self._last_frames[tracked] = frame_number
+
+        new = np.setdiff1d(np.arange(len(blobs)), detected)
+        new_ids = np.arange(self._next_id, self._next_id + len(new))
+        self._next_id += len(new)
+        self._ids = np.concatenate([self._ids, new_ids])
+        self._positions = np.concatenate([self._positions, blobs[new, :2]])
+        self._velocities = np.concatenate([self._velocities, np.zeros((len(new), 2))])
+        self._last_frames = np.concatenate([self._last_frames, np.full(len(new), float(frame_number))])
+
+        ids = np.empty(len(blobs))
+        if len(tracked):
+            ids[detected] = self._ids[tracked]
+        ids[new] = new_ids
+        self._append(frame_number, time, blobs, ids)
+
+    def _append(self, frame_number, time, blobs, ids):
+        end = self._length + len(blobs)
+        if end > len(self._rows):
+            self._rows = np.concatenate([self._rows, np.empty((max(end, len(self._rows)), ATHLETE + 1))])
+        rows = self._rows[self._length:end]
+        rows[:, FRAME] = frame_number
+        rows[:, TIME] = time
+        rows[:, [X, Y, AREA]] = blobs
+        rows[:, ATHLETE] = ids
+        self._length = end
+
+    @property
+    def rows(self):
+        """Combined track of every athlete: CentroidTrack columns plus ATHLETE, in frame order"""
+        return self._rows[:self._length]
+
+
+def athlete_results(rows, endpoints, target_laps, duration, min_frames=MIN_ATHLETE_FRAMES):
+    """Laps and lap times for each athlete in a combined athlete track"""
+    athletes = []
+    for athlete_id in np.unique(rows[:, ATHLETE]):
+        track = rows[rows[:, ATHLETE] == athlete_id]
+        if len(track) < min_frames:
+            continue
+        crossings = find_line_crossings(track, endpoints)
+        total_laps, lap_times = lap_results(crossings, target_laps, duration)
+        athletes.append({
+            "id": int(athlete_id),
+            "total_laps": total_laps,
+            "lap_times": lap_times,
+            "last_lap_unfinished": last_lap_unfinished(crossings, target_laps),
+            "tracked_frames": len(track),
+            "first_seen": float(track[0, TIME]),
+            "last_seen": float(track[-1, TIME])
+        })
+    return athletes
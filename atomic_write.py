@@ -0,0 +1,49 @@
+"""Atomic file writes shared by the caches, indexes and profiles.
+
+A file is written under a temporary name next to its final path, unique to
+the writing process and thread, then renamed over the final path, so readers
+in other threads and processes never see a partial file.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+
+def temp_path(path, extension=''):
+    """Temporary path to write path's new contents to before renaming it into place
+
+    extension is kept at the end, for writers that choose a format from it.
+    """
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp{extension}'
+
+
+def _write_atomic(path, mode, write):
+    temp = temp_path(path)
+    try:
+        with open(temp, mode) as f:
+            write(f)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data, indent=2):
+    """Write data as JSON to path"""
+    _write_atomic(path, 'w', lambda f: json.dump(data, f, indent=indent))
+
+
+def write_npy_atomic(path, array):
+    """Write a NumPy array to path in .npy format"""
+    _write_atomic(path, 'wb', lambda f: np.save(f, np.ascontiguousarray(array)))
+
+
+def write_bytes_atomic(path, data):
+    """Write bytes to path"""
+    _write_atomic(path, 'wb', lambda f: f.write(data))
@@ -0,0 +1,182 @@
+"""Offline batch analysis of a directory or manifest of videos.
+
+Usage:
+    python batch.py uploads/
+    python batch.py --manifest videos.csv --workers 4 --summary summary.csv
+
+Each video's results are added to the same results store as the web app's,
+so /results/<filename> and the leaderboards include them, and a CSV summary
+of the whole batch is written at the end. Re-running the same command skips
+every video whose results are already stored for the same video contents
+and settings, so an interrupted batch resumes where it stopped.
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from analyzer import analyze_video, analysis_parameters, ANALYSIS_MODES
+from result_cache import file_sha256, make_cache_key
+from results_store import ResultsStore, labelled_result_id, LABEL_COLUMNS
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+SUMMARY_FIELDS = ['video_filename', 'athlete', 'session', 'status', 'total_laps', 'target_laps', 'lap_times',
+                  'distance_meters', 'duration', 'analysis_mode', 'athletes', 'error']
+
+
+def find_videos(directory):
+    """Video files directly inside directory, sorted by name"""
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.lower().endswith(VIDEO_EXTENSIONS)]
+
+
+def read_manifest(path, defaults):
+    """Videos and per-video settings from a CSV manifest
+
+    The manifest needs a 'video' column; 'target_laps', 'known_distance',
+    'analysis_mode', 'multi_athlete', 'athlete' and 'session' columns are
+    optional and fall back to defaults. Relative video paths are relative to
+    the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    videos = []
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            settings = dict(defaults)
+            if row.get('target_laps'):
+                settings['target_laps'] = int(row['target_laps'])
+            if row.get('known_distance'):
+                settings['known_distance'] = float(row['known_distance'])
+            if row.get('analysis_mode'):
+                settings['analysis_mode'] = row['analysis_mode']
+            if row.get('multi_athlete'):
+                settings['multi_athlete'] = row['multi_athlete'].lower() in ('1', 'true', 'yes')
+            for label in ('athlete', 'session'):
+                if row.get(label):
+                    settings[label] = row[label]
+            videos.append((os.path.join(base, row['video']), settings))
+    return videos
+
+
+def analyze_one(video_path, settings, verbose=False):
+    """Analyze one video in a worker process"""
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        return analyze_video(video_path, settings['target_laps'], settings['known_distance'],
+                             settings['analysis_mode'], multi_athlete=settings['multi_athlete'])
+
+
+def summary_row(video_path, result):
+    row = {field: result.get(field, '') for field in SUMMARY_FIELDS}
+    row['video_filename'] = os.path.basename(video_path)
+    row['status'] = 'failed' if 'error' in result else 'completed'
+    row['lap_times'] = ';'.join(f'{lap_time:.3f}' for lap_time in result.get('lap_times', []))
+    row['athletes'] = len(result['athletes']) if 'athletes' in result else ''
+    return row
+
+
+def run_batch(videos, store, workers=None, verbose=False):
+    """Analyze (video_path, settings) pairs and return {video_path: result}
+
+    Videos with up-to-date results in the ResultsStore are not analyzed again.
+    """
+    results = {}
+    pending = {}
+    for video_path, settings in videos:
+        video_hash = file_sha256(video_path)
+        parameters = analysis_parameters(settings['target_laps'], settings['known_distance'],
+                                         settings['analysis_mode'], multi_athlete=settings['multi_athlete'])
+        labels = {label: settings[label] for label in LABEL_COLUMNS if settings.get(label)}
+        result_id = labelled_result_id(make_cache_key(video_hash, parameters), labels)
+        finished = store.get(result_id)
+        if finished is not None:
+            print(f"Skipping {video_path}, results are up to date")
+            results[video_path] = finished
+        else:
+            pending[video_path] = (settings, video_hash, result_id)
+
+    print(f"Analyzing {len(pending)} of {len(videos)} video(s)")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_one, video_path, settings, verbose): video_path
+                   for video_path, (settings, _, _) in pending.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            video_path = futures[future]
+            _, video_hash, result_id = pending[video_path]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'error': f'Video processing error: {str(e)}'}
+
+            if 'error' in result:
+                # Not stored, so the next run tries this video again
+                print(f"[{done}/{len(pending)}] {video_path} failed: {result['error']}")
+            else:
+                settings = pending[video_path][0]
+                labels = {label: settings[label] for label in LABEL_COLUMNS if settings.get(label)}
+                result.update(video_filename=os.path.basename(video_path), video_hash=video_hash,
+                              result_id=result_id, timestamp=datetime.now().isoformat(), **labels)
+                store.put(result)
+                print(f"[{done}/{len(pending)}] {video_path}: "
+                      f"{result['total_laps']}/{result['target_laps']} laps")
+            results[video_path] = result
+    return results
+
+
+def write_summary(path, videos, results):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for video_path, _ in videos:
+            writer.writerow(summary_row(video_path, results[video_path]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze a directory or manifest of shuttle run videos')
+    parser.add_argument('directory', nargs='?', help='directory of videos to analyze')
+    parser.add_argument('--manifest', help='CSV with a video column and optional target_laps, known_distance, '
+                                           'analysis_mode, multi_athlete, athlete and session columns')
+    parser.add_argument('--target-laps', type=int, default=10)
+    parser.add_argument('--known-distance', type=float, default=20)
+    parser.add_argument('--analysis-mode', choices=list(ANALYSIS_MODES), default='accurate')
+    parser.add_argument('--multi-athlete', action='store_true',
+                        help='track every athlete and report laps for each one')
+    parser.add_argument('--session', help='session to tag every result with, e.g. a class and date')
+    parser.add_argument('--store', default='static/results/results.db', help='results database')
+    parser.add_argument('--summary', help='CSV summary path (default: batch_summary.csv beside the store)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--verbose', action='store_true', help='show the analyzer output for each video')
+    args = parser.parse_args(argv)
+
+    if bool(args.directory) == bool(args.manifest):
+        parser.error('give either a directory or --manifest')
+
+    defaults = {'target_laps': args.target_laps, 'known_distance': args.known_distance,
+                'analysis_mode': args.analysis_mode, 'multi_athlete': args.multi_athlete,
+                'session': args.session}
+    if args.manifest:
+        videos = read_manifest(args.manifest, defaults)
+    else:
+        videos = [(video_path, defaults) for video_path in find_videos(args.directory)]
+
+    for video_path, settings in videos:
+        if not os.path.isfile(video_path):
+            parser.error(f'video not found: {video_path}')
+        if settings['analysis_mode'] not in ANALYSIS_MODES:
+            parser.error(f'invalid analysis mode for {video_path}: {settings["analysis_mode"]}')
+
+    results = run_batch(videos, ResultsStore(args.store), args.workers, args.verbose)
+    summary = args.summary or os.path.join(os.path.dirname(args.store), 'batch_summary.csv')
+    write_summary(summary, videos, results)
+    failed = sum(1 for result in results.values() if 'error' in result)
+    print(f"Done: {len(results) - failed} completed, {failed} failed. Summary written to {summary}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
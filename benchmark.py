@@ -0,0 +1,233 @@
+"""Benchmark the analysis pipeline on synthetic shuttle run videos.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --size 1920x1080 --fps 60 --duration 30 --laps 8 --modes accurate fast
+    python benchmark.py --json results.json
+    python benchmark.py --compare results.json
+
+Each video is generated deterministically: two red cones on a noisy gray
+background whose brightness slowly drifts, and a light blob that crosses
+the line between the cones at known times. Every case runs in a fresh
+process, which times endpoint detection, distance estimation and the full
+track_athlete_movement call, and reports tracking speed, peak memory and
+how far the lap times are from the ground truth.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from analyzer import ShuttleRunAnalyzer, ANALYSIS_MODES, PIPELINE_WORKERS
+from frame_source import FrameSource
+from laps import lap_results
+
+# Seconds before the athlete enters, so frame 0 shows the empty lane
+START_DELAY = 0.5
+
+
+def synthetic_crossings(duration, laps):
+    """Ground-truth times at which the synthetic athlete crosses the line
+
+    laps + 1 crossings: the first starts the clock and each later one
+    completes a lap. The athlete turns around halfway between crossings, and
+    the video ends at a turn.
+    """
+    interval = (duration - START_DELAY) / (laps + 1)
+    return START_DELAY + interval * (np.arange(laps + 1) + 0.5)
+
+
+def make_synthetic_video(path, width=640, height=480, fps=30, duration=20.0, laps=6,
+                         drift=15, seed=0):
+    """Write a synthetic shuttle run video and return its ground-truth crossing times"""
+    interval = (duration - START_DELAY) / (laps + 1)
+    unit = height / 480
+    line_y = height // 2
+    amplitude = 0.35 * height
+    cone = max(4, int(10 * unit))
+    half_width, half_height = int(20 * unit), int(40 * unit)
+
+    # A few noise frames are cycled so generation stays fast but every frame is grainy
+    rng = np.random.default_rng(seed)
+    noise = [rng.normal(0, 3, (height, width, 1)).astype(np.int16) for _ in range(8)]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    for i in range(int(round(duration * fps))):
+        t = i / fps
+        level = 90 + drift * t / duration
+        frame[:] = np.clip(level + noise[i % len(noise)], 0, 255).astype(np.uint8)
+        for x in (int(0.15 * width), int(0.85 * width)):
+            cv2.rectangle(frame, (x - cone, line_y - cone), (x + cone, line_y + cone), (0, 0, 255), -1)
+
+        if t >= START_DELAY:
+            # Triangle wave: -1 at the start, crossing zero every interval
+            phase = (t - START_DELAY) / interval
+            offset = 1 - 2 * abs(phase % 2 - 1)
+            y = int(round(line_y + amplitude * offset))
+            x = width // 2
+            cv2.rectangle(frame, (x - half_width, y - half_height), (x + half_width, y + half_height),
+                          (230, 230, 230), -1)
+        writer.write(frame)
+    writer.release()
+    return synthetic_crossings(duration, laps)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(video_path, expected_crossings, laps, mode, known_distance=20):
+    """Time each analysis stage on one video; runs in a fresh worker process"""
+    analyzer = ShuttleRunAnalyzer()
+    timings = {}
+
+    with FrameSource(video_path) as source:
+        first_frame = source.first_frame
+        started = time.perf_counter()
+        endpoints = analyzer.detect_endpoints(first_frame)
+        timings['detect_endpoints'] = time.perf_counter() - started
+
+        distance_pixels = analyzer.calculate_distance(endpoints[0], endpoints[1]) if len(endpoints) >= 2 else 0
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyzer.calculate_actual_distance_from_video(source, distance_pixels)
+        timings['calculate_actual_distance_from_video'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = analyzer.track_athlete_movement(video_path, laps, known_distance,
+                                                 pipeline_workers=PIPELINE_WORKERS, **ANALYSIS_MODES[mode])
+    timings['track_athlete_movement'] = time.perf_counter() - started
+
+    if 'error' in result:
+        return {'error': result['error'], 'timings': timings}
+
+    _, expected_lap_times = lap_results(expected_crossings, laps, result['duration'])
+    lap_errors = [abs(a - b) for a, b in zip(result['lap_times'], expected_lap_times)]
+    return {
+        'timings': timings,
+        'frames': result['processed_frames'],
+        'tracked_frames': result['tracked_frames'],
+        'fps': result['processed_frames'] / timings['track_athlete_movement'],
+        'peak_rss_mb': peak_rss_mb(),
+        'laps_found': result['total_laps'],
+        'laps_expected': len(expected_lap_times) + 1,
+        'max_lap_error': max(lap_errors) if lap_errors else None,
+        'lap_count_correct': len(result['lap_times']) == len(expected_lap_times),
+    }
+
+
+def run_benchmarks(sizes, fps, duration, laps, modes, drift=15, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for width, height in sizes:
+            video_path = os.path.join(directory, f'synthetic_{width}x{height}.mp4')
+            print(f"Generating {width}x{height} at {fps} fps, {duration:g}s, {laps} laps...")
+            crossings = make_synthetic_video(video_path, width, height, fps, duration, laps, drift, seed)
+            for mode in modes:
+                # A fresh process per case, so peak memory is per case too
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    case = pool.submit(run_case, video_path, crossings, laps, mode).result()
+                case.update(size=f'{width}x{height}', mode=mode)
+                results.append(case)
+                print_case(case)
+    return results
+
+
+def print_case(case):
+    if 'error' in case:
+        print(f"  {case['size']:>10} {case['mode']:<9} error: {case['error']}")
+        return
+    timings = case['timings']
+    lap_error = 'n/a' if case['max_lap_error'] is None else f"{case['max_lap_error'] * 1000:.0f}ms"
+    rss = 'n/a' if case['peak_rss_mb'] is None else f"{case['peak_rss_mb']:.0f}MB"
+    print(f"  {case['size']:>10} {case['mode']:<9} "
+          f"endpoints {timings['detect_endpoints'] * 1000:6.1f}ms  "
+          f"distance {timings['calculate_actual_distance_from_video'] * 1000:6.1f}ms  "
+          f"tracking {timings['track_athlete_movement']:6.2f}s ({case['fps']:6.1f} fps)  "
+          f"peak RSS {rss}  laps {case['laps_found']}/{case['laps_expected']}  "
+          f"max lap error {lap_error}")
+
+
+def compare(results, baseline, tolerance):
+    """Describe every case that is slower or less accurate than in baseline"""
+    previous = {(case['size'], case['mode']): case for case in baseline}
+    regressions = []
+    for case in results:
+        old = previous.get((case['size'], case['mode']))
+        if old is None or 'error' in old:
+            continue
+        name = f"{case['size']} {case['mode']}"
+        if 'error' in case:
+            regressions.append(f"{name}: failed ({case['error']})")
+            continue
+        if case['fps'] < old['fps'] * (1 - tolerance):
+            regressions.append(f"{name}: {case['fps']:.1f} fps, was {old['fps']:.1f}")
+        if old['lap_count_correct'] and not case['lap_count_correct']:
+            regressions.append(f"{name}: found {case['laps_found']} laps, expected {case['laps_expected']}")
+        if (case['max_lap_error'] is not None and old['max_lap_error'] is not None and
+                case['max_lap_error'] > old['max_lap_error'] + 1 / 60):
+            regressions.append(f"{name}: max lap error {case['max_lap_error']:.3f}s, "
+                               f"was {old['max_lap_error']:.3f}s")
+    return regressions
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the analyzer on synthetic shuttle run videos')
+    parser.add_argument('--size', type=parse_size, action='append', dest='sizes',
+                        help='video size like 1280x720; may be repeated (default: 640x480 and 1280x720)')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--laps', type=int, default=6)
+    parser.add_argument('--modes', nargs='+', choices=list(ANALYSIS_MODES), default=list(ANALYSIS_MODES))
+    parser.add_argument('--drift', type=float, default=15, help='background brightness change over the video')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed fractional drop in fps when comparing (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes or [(640, 480), (1280, 720)], args.fps, args.duration,
+                             args.laps, args.modes, args.drift, args.seed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
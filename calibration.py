@@ -0,0 +1,180 @@
+"""Saved calibration profiles for fixed camera stations.
+
+A tripod-mounted camera sees the same endpoints in every video, so a
+profile stores its endpoints and scale once, keyed by a station ID. Uploads
+that name a station skip endpoint and scale detection. Instead, a small
+patch around each marker, saved with the profile, is template-matched
+against the first frame to warn when the camera or the markers have moved.
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from atomic_write import write_json_atomic
+
+# Side of the square patch saved around each endpoint marker, in pixels
+MARKER_PATCH_SIZE = 32
+
+# How far (in pixels) around its saved position a marker is searched for
+DRIFT_SEARCH_PIXELS = 24
+
+# A marker found further than this from its saved position has drifted
+DRIFT_TOLERANCE_PIXELS = 6
+
+# Normalized correlation below which a marker counts as missing
+MIN_MARKER_SCORE = 0.6
+
+STATION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def _patch_box(point, width, height, size=MARKER_PATCH_SIZE):
+    """(x0, y0, x1, y1) square around point, clipped to the frame"""
+    x, y = int(round(point[0])), int(round(point[1]))
+    half = size // 2
+    return max(0, x - half), max(0, y - half), min(width, x + half), min(height, y + half)
+
+
+def ground_distance(homography, point1, point2):
+    """Distance in meters between two image points mapped through an image-to-ground homography"""
+    points = np.array([[point1, point2]], dtype=np.float64)
+    (ground1, ground2), = cv2.perspectiveTransform(points, np.array(homography, dtype=np.float64))
+    return float(np.hypot(*(ground2 - ground1)))
+
+
+def make_profile(station_id, frame, endpoints, distance_meters=None, homography=None):
+    """Calibration profile for a station from a reference frame and its endpoints
+
+    The scale comes from the homography (a 3x3 image-to-ground-plane matrix
+    in meters) if one is given, otherwise from the distance between the
+    endpoints in meters.
+    """
+    if not STATION_ID_PATTERN.match(station_id):
+        raise ValueError('station ID may only contain letters, digits, ".", "_" and "-"')
+    endpoints = [[float(x), float(y)] for x, y in endpoints[:2]]
+    distance_pixels = float(np.hypot(endpoints[1][0] - endpoints[0][0], endpoints[1][1] - endpoints[0][1]))
+    if homography is not None:
+        homography = np.array(homography, dtype=np.float64).reshape(3, 3).tolist()
+        distance_meters = ground_distance(homography, *endpoints)
+    if not distance_meters or not distance_pixels:
+        raise ValueError('a calibration needs two distinct endpoints and a distance or homography')
+
+    height, width = frame.shape[:2]
+    markers = []
+    for point in endpoints:
+        x0, y0, x1, y1 = _patch_box(point, width, height)
+        gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        ok, png = cv2.imencode('.png', gray)
+        markers.append({'box': [x0, y0, x1, y1], 'patch': base64.b64encode(png.tobytes()).decode('ascii')})
+
+    return {
+        'station_id': station_id,
+        'endpoints': endpoints,
+        'distance_meters': distance_meters,
+        'pixels_per_meter': distance_pixels / distance_meters,
+        'homography': homography,
+        'frame_size': [width, height],
+        'markers': markers,
+        'updated': time.time()
+    }
+
+
+def profile_parameters(profile):
+    """The settings of a profile that change analysis results, e.g. for cache keys"""
+    return {key: profile[key] for key in
+            ('station_id', 'endpoints', 'distance_meters', 'pixels_per_meter', 'homography', 'updated')}
+
+
+def calibrated_distance(calibration, endpoints):
+    """(distance_meters, pixels_per_meter) between endpoints under a profile's calibration"""
+    distance_pixels = float(np.hypot(endpoints[1][0] - endpoints[0][0], endpoints[1][1] - endpoints[0][1]))
+    if calibration.get('homography') is not None and distance_pixels:
+        distance_meters = ground_distance(calibration['homography'], endpoints[0], endpoints[1])
+        return distance_meters, distance_pixels / distance_meters
+    return distance_pixels / calibration['pixels_per_meter'], calibration['pixels_per_meter']
+
+
+def check_drift(profile, frame):
+    """Compare the first frame of a video with the markers saved in a profile
+
+    Returns {'drifted', 'offsets', 'scores'} plus a 'warning' message when the
+    camera or the markers appear to have moved since the profile was saved.
+    """
+    height, width = frame.shape[:2]
+    if [width, height] != profile['frame_size']:
+        return {'drifted': True, 'offsets': [], 'scores': [],
+                'warning': f"Video is {width}x{height} but station {profile['station_id']} "
+                           f"was calibrated at {profile['frame_size'][0]}x{profile['frame_size'][1]}"}
+
+    offsets, scores = [], []
+    for marker in profile['markers']:
+        patch = cv2.imdecode(np.frombuffer(base64.b64decode(marker['patch']), dtype=np.uint8),
+                             cv2.IMREAD_GRAYSCALE)
+        x0, y0, x1, y1 = marker['box']
+        sx0, sy0 = max(0, x0 - DRIFT_SEARCH_PIXELS), max(0, y0 - DRIFT_SEARCH_PIXELS)
+        sx1, sy1 = min(width, x1 + DRIFT_SEARCH_PIXELS), min(height, y1 + DRIFT_SEARCH_PIXELS)
+        search = cv2.cvtColor(frame[sy0:sy1, sx0:sx1], cv2.COLOR_BGR2GRAY)
+        match = np.nan_to_num(cv2.matchTemplate(search, patch, cv2.TM_CCOEFF_NORMED))
+        _, score, _, (mx, my) = cv2.minMaxLoc(match)
+        offsets.append([sx0 + mx - x0, sy0 + my - y0])
+        scores.append(round(float(score), 3))
+
+    moved = max(float(np.hypot(dx, dy)) for dx, dy in offsets)
+    drift = {'drifted': moved > DRIFT_TOLERANCE_PIXELS or min(scores) < MIN_MARKER_SCORE,
+             'offsets': offsets, 'scores': scores}
+    if drift['drifted']:
+        drift['warning'] = (f"Markers no longer match station {profile['station_id']}'s calibration "
+                            f"(moved up to {moved:.0f}px, match score {min(scores):.2f}); "
+                            f"recalibrate the station")
+    return drift
+
+
+class ProfileStore:
+    """Calibration profiles stored as one JSON file per station in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, station_id):
+        if not STATION_ID_PATTERN.match(station_id):
+            raise ValueError('station ID may only contain letters, digits, ".", "_" and "-"')
+        return os.path.join(self.directory, f'{station_id}.json')
+
+    def get(self, station_id):
+        """Return the profile for station_id, or None"""
+        try:
+            with open(self._path(station_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, profile):
+        with self._lock:
+            write_json_atomic(self._path(profile['station_id']), profile)
+
+    def delete(self, station_id):
+        """Remove a profile; returns False if there was none"""
+        with self._lock:
+            try:
+                os.remove(self._path(station_id))
+                return True
+            except (FileNotFoundError, ValueError):
+                return False
+
+    def list(self):
+        """Every stored profile, without its marker patches, sorted by station ID"""
+        profiles = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.json'):
+                profile = self.get(name[:-len('.json')])
+                if profile is not None:
+                    profiles.append({key: value for key, value in profile.items() if key != 'markers'})
+        return profiles
@@ -0,0 +1,443 @@
+"""Single-pass access to the frames of a video file.
+
+Endpoint detection, scale estimation and tracking all read from one
+FrameSource, so every frame is decoded exactly once and the capture is never
+reopened or rewound. For random access, a keyframe index built from the
+container's sample tables (stored beside the video) lets read_frame() seek
+to the keyframe before a frame and decode forward to it exactly.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+from atomic_write import write_json_atomic
+from metrics import REGISTRY
+
+
+class FrameSource:
+    def __init__(self, video_path, index=None):
+        self.video_path = video_path
+        self._index = index
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self._pending = None  # Frame decoded by first_frame but not yet yielded
+        self._first_frame = None
+        self._next_frame_number = 0
+        # Yield every frame_step-th frame; may be changed while iterating
+        self.frame_step = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    @property
+    def first_frame(self):
+        """Frame 0, decoded once and handed to the frame iterator afterwards"""
+        if self._first_frame is None and self._next_frame_number == 0:
+            with REGISTRY.timer('decode'):
+                ret, frame = self.cap.read()
+            if ret:
+                self._first_frame = self._pending = frame
+        return self._first_frame
+
+    @property
+    def position(self):
+        """Number of the next frame that read() or the iterator will return"""
+        return self._next_frame_number
+
+    def seek(self, frame_number):
+        """Move to frame_number; the next read() decodes that frame"""
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        self._pending = None
+        self._next_frame_number = frame_number
+
+    @property
+    def index(self):
+        """FrameIndex of the video, loaded (or built) on first use"""
+        if self._index is None:
+            self._index = load_frame_index(self.video_path)
+        return self._index
+
+    def _skip(self):
+        """Move past the next frame without retrieving it; False at the end"""
+        if self._pending is not None:
+            self._pending = None
+        else:
+            with REGISTRY.timer('decode_skipped'):
+                if not self.cap.grab():
+                    return False
+        self._next_frame_number += 1
+        return True
+
+    def read_frame(self, frame_number, buffer=None):
+        """Decode exactly frame frame_number, or return None past the end
+
+        Reading forward within a GOP only decodes the frames in between.
+        Anything else seeks to the keyframe at or before the frame, where
+        seeking is exact, and decodes forward from there. Without a known
+        keyframe this falls back to seeking to the frame directly.
+        """
+        keyframe = self.index.keyframe_before(frame_number)
+        behind = frame_number < self._next_frame_number
+        if keyframe is None:
+            if behind or frame_number > self._next_frame_number:
+                self.seek(frame_number)
+        elif behind or keyframe > self._next_frame_number:
+            self.seek(keyframe)
+        while self._next_frame_number < frame_number:
+            if not self._skip():
+                return None
+        item = self.read(buffer)
+        return item[1] if item else None
+
+    def read(self, buffer=None):
+        """Return (frame_number, frame) for the next frame, or None at the end
+
+        If buffer has the frame's shape the frame is decoded into it instead of
+        a newly allocated array.
+        """
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+        else:
+            with REGISTRY.timer('decode'):
+                ret, frame = self.cap.read(buffer)
+            if not ret:
+                return None
+        frame_number = self._next_frame_number
+        self._next_frame_number += 1
+        return frame_number, frame
+
+    def __iter__(self):
+        """Yield (frame_number, frame) from the current position to the end
+
+        After each yielded frame, frame_step - 1 frames are skipped with
+        grab(), which decodes them but avoids the colour conversion and copy.
+        """
+        while True:
+            item = self.read()
+            if item is None:
+                return
+            yield item
+
+            for _ in range(self.frame_step - 1):
+                if not self._skip():
+                    return
+
+
+def frame_digest(frame):
+    """Short content hash of a decoded frame"""
+    return hashlib.blake2b(np.ascontiguousarray(frame), digest_size=16).hexdigest()
+
+
+def _mp4_boxes(f, start, end):
+    """Yield (type, payload_start, box_end) for the ISO-BMFF boxes in [start, end)"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield box_type, position + header, position + size
+        position += size
+
+
+def _mp4_child(f, start, end, box_type):
+    for child_type, payload_start, box_end in _mp4_boxes(f, start, end):
+        if child_type == box_type:
+            return payload_start, box_end
+    return None
+
+
+def _read_table(f, box, dtype='>u4', columns=1, header=8):
+    """Entries of a sample table box as an int64 array of shape (entry_count, columns)
+
+    header is the size of the fields before the entries; the entry count is
+    the last of them.
+    """
+    f.seek(box[0] + header - 4)
+    entry_count = struct.unpack('>I', f.read(4))[0]
+    dtype = np.dtype(dtype)
+    table = np.frombuffer(f.read(dtype.itemsize * columns * entry_count), dtype=dtype)
+    return table.astype(np.int64).reshape(-1, columns)
+
+
+def read_mp4_index(video_path):
+    """FrameIndex of the first video track of an MP4/MOV file, or None
+
+    Built from the sample tables alone, without decoding: the sync sample
+    table (stss) gives the keyframes, the time-to-sample and composition
+    offset tables their presentation order and timestamps, and the chunk
+    tables their byte offsets. Returns None when the file is not an MP4/MOV
+    or is fragmented.
+    """
+    try:
+        with open(video_path, 'rb') as f:
+            f.seek(0, 2)
+            moov = _mp4_child(f, 0, f.tell(), b'moov')
+            if moov is None:
+                return None
+            for box_type, trak_start, trak_end in _mp4_boxes(f, *moov):
+                if box_type != b'trak':
+                    continue
+                mdia = _mp4_child(f, trak_start, trak_end, b'mdia')
+                hdlr = mdia and _mp4_child(f, *mdia, b'hdlr')
+                if hdlr is None:
+                    continue
+                f.seek(hdlr[0] + 8)  # version/flags and pre_defined
+                if f.read(4) != b'vide':
+                    continue
+
+                mdhd = _mp4_child(f, *mdia, b'mdhd')
+                f.seek(mdhd[0])
+                version = f.read(1)[0]
+                f.seek(mdhd[0] + (20 if version == 1 else 12))
+                timescale = struct.unpack('>I', f.read(4))[0]
+
+                minf = _mp4_child(f, *mdia, b'minf')
+                stbl = minf and _mp4_child(f, *minf, b'stbl')
+                if stbl is None:
+                    return None
+                tables = {name: _mp4_child(f, *stbl, name)
+                          for name in (b'stss', b'stts', b'ctts', b'stsz', b'stsc', b'stco', b'co64')}
+
+                # Decode timestamps, shifted to presentation timestamps by ctts
+                stts = _read_table(f, tables[b'stts'], columns=2)
+                if len(stts) == 0:
+                    return None  # Samples live in movie fragments
+                deltas = np.repeat(stts[:, 1], stts[:, 0])
+                timestamps = np.concatenate([[0], np.cumsum(deltas)[:-1]])
+                if tables[b'ctts']:
+                    f.seek(tables[b'ctts'][0])
+                    # Version 1 offsets are signed
+                    ctts = _read_table(f, tables[b'ctts'], '>i4' if f.read(1)[0] == 1 else '>u4', columns=2)
+                    timestamps = timestamps + np.repeat(ctts[:, 1], ctts[:, 0])[:len(timestamps)]
+                sample_count = len(timestamps)
+
+                # Decoders hand frames out in presentation order, which is
+                # what frame numbers count
+                order = np.argsort(timestamps, kind='stable')
+                frame_numbers = np.empty(sample_count, dtype=np.int64)
+                frame_numbers[order] = np.arange(sample_count)
+
+                # Byte offset of every sample from its chunk's offset and the
+                # sizes of the samples before it in the chunk
+                f.seek(tables[b'stsz'][0] + 4)
+                sample_size, count = struct.unpack('>II', f.read(8))
+                if sample_size:
+                    sizes = np.full(count, sample_size, dtype=np.int64)
+                else:
+                    sizes = _read_table(f, tables[b'stsz'], header=12)[:, 0]
+                if tables[b'co64']:
+                    chunk_offsets = _read_table(f, tables[b'co64'], '>u8')[:, 0]
+                else:
+                    chunk_offsets = _read_table(f, tables[b'stco'])[:, 0]
+                stsc = _read_table(f, tables[b'stsc'], columns=3)
+                run_ends = np.append(stsc[1:, 0], len(chunk_offsets) + 1)
+                per_chunk = np.repeat(stsc[:, 1], run_ends - stsc[:, 0])
+                chunk_of_sample = np.repeat(np.arange(len(per_chunk)), per_chunk)[:sample_count]
+                chunk_first_sample = np.cumsum(per_chunk) - per_chunk
+                ends = np.cumsum(sizes)
+                starts = ends - sizes
+                offsets = (chunk_offsets[chunk_of_sample] + starts[:sample_count] -
+                           starts[chunk_first_sample[chunk_of_sample]])
+
+                # Without stss every sample is a keyframe
+                if tables[b'stss']:
+                    sync = _read_table(f, tables[b'stss'])[:, 0] - 1
+                else:
+                    sync = np.arange(sample_count)
+                sync = sync[np.argsort(frame_numbers[sync])]
+                start_time = timestamps.min()
+                return FrameIndex(sample_count,
+                                  frame_numbers[sync].tolist(),
+                                  ((timestamps[sync] - start_time) / timescale).tolist(),
+                                  offsets[sync].tolist())
+    except (OSError, struct.error, TypeError, IndexError, ValueError) as e:
+        print(f"Could not index {video_path}: {str(e)}")
+    return None
+
+
+class FrameIndex:
+    """Keyframe numbers, presentation timestamps (seconds) and byte offsets of a video
+
+    keyframes is None when they are not known, e.g. for formats other than
+    MP4/MOV; the timestamps and offsets may be None too.
+    """
+
+    def __init__(self, frame_count, keyframes, keyframe_times=None, keyframe_offsets=None):
+        self.frame_count = frame_count
+        self.keyframes = keyframes
+        self.keyframe_times = keyframe_times
+        self.keyframe_offsets = keyframe_offsets
+
+    def keyframe_before(self, frame_number):
+        """Last keyframe at or before frame_number, or None if keyframes are unknown"""
+        if not self.keyframes:
+            return None
+        position = bisect.bisect_right(self.keyframes, frame_number)
+        return self.keyframes[position - 1] if position else None
+
+    def to_dict(self):
+        return {
+            'frame_count': self.frame_count,
+            'keyframes': self.keyframes,
+            'keyframe_times': self.keyframe_times,
+            'keyframe_offsets': self.keyframe_offsets
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['frame_count'], data['keyframes'], data.get('keyframe_times'),
+                   data.get('keyframe_offsets'))
+
+
+def frame_index_path(video_path):
+    """Where the frame index of a video is stored, beside the video"""
+    return f'{video_path}.index.json'
+
+
+def _file_signature(video_path):
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_frame_index(video_path):
+    """Index a video's keyframes and store the index beside it; returns the FrameIndex"""
+    index = read_mp4_index(video_path)
+    if index is None:
+        cap = cv2.VideoCapture(video_path)
+        index = FrameIndex(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), None)
+        cap.release()
+
+    data = dict(index.to_dict(), video=_file_signature(video_path))
+    try:
+        write_json_atomic(frame_index_path(video_path), data, indent=None)
+    except OSError as e:
+        print(f"Could not store frame index for {video_path}: {str(e)}")
+    return index
+
+
+def load_frame_index(video_path):
+    """The stored frame index of a video, rebuilt if missing or the video has changed"""
+    try:
+        with open(frame_index_path(video_path), 'r') as f:
+            data = json.load(f)
+        if data.get('video') == _file_signature(video_path):
+            return FrameIndex.from_dict(data)
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_frame_index(video_path)
+
+
+def pipelined_map(source, fn, workers=2, queue_size=8, scratch=None):
+    """Yield (frame_number, fn(frame_number, frame)) for every remaining frame, in order
+
+    A decoder thread reads frames into a bounded queue, reusing a fixed pool
+    of preallocated buffers, and worker threads apply fn. OpenCV releases the
+    GIL while decoding and processing, so the stages run in parallel. A buffer
+    goes back to the pool once its result has been yielded and the caller
+    asks for the next one, so fn's result must not outlive that.
+
+    If scratch is given, it is called once per buffer and fn is called as
+    fn(frame_number, frame, scratch_object), so fn can also write its output
+    into preallocated memory.
+    """
+    first_frame = source.first_frame
+    if first_frame is None:
+        return
+
+    free_buffers = queue.Queue()
+    for _ in range(queue_size + workers + 1):
+        free_buffers.put((np.empty_like(first_frame), scratch() if scratch else None))
+    work = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def decode():
+        try:
+            while not stop.is_set():
+                buffer = free_buffers.get()
+                if buffer is None:
+                    break
+                item = source.read(buffer[0])
+                if item is None:
+                    break
+                work.put((item[0], item[1], buffer))
+        except Exception as e:
+            results.put((None, None, None, e))
+        finally:
+            for _ in range(workers):
+                work.put(None)
+
+    def process():
+        while True:
+            item = work.get()
+            if item is None:
+                results.put(None)
+                return
+            frame_number, frame, buffer = item
+            try:
+                if scratch:
+                    result = fn(frame_number, frame, buffer[1])
+                else:
+                    result = fn(frame_number, frame)
+                results.put((frame_number, result, buffer, None))
+            except Exception as e:
+                free_buffers.put(buffer)
+                results.put((frame_number, None, None, e))
+
+    next_frame = source.position
+    threads = [threading.Thread(target=decode, daemon=True)]
+    threads += [threading.Thread(target=process, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # Workers finish out of order; hold results back until their turn
+    pending = {}
+    finished_workers = 0
+    try:
+        while finished_workers < workers:
+            item = results.get()
+            if item is None:
+                finished_workers += 1
+                continue
+            frame_number, result, buffer, error = item
+            if error is not None:
+                raise error
+            pending[frame_number] = result, buffer
+            while next_frame in pending:
+                result, buffer = pending.pop(next_frame)
+                yield next_frame, result
+                free_buffers.put(buffer)
+                next_frame += 1
+    finally:
+        stop.set()
+        # Buffers held by unread results never come back; wake the decoder
+        free_buffers.put(None)
+        for thread in threads:
+            thread.join()
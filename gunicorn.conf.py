@@ -0,0 +1,40 @@
+"""gunicorn settings for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+BIND, WEB_THREADS and WEB_TIMEOUT override the defaults below. Startup
+timings (import, warm-up, ready) and the first request's latency are logged
+and exported by /metrics.
+"""
+
+import os
+import time
+
+# This file is read first thing at boot, so ready_seconds covers the whole startup
+_started = time.time()
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Job records and their event streams live in the web process's memory, so
+# one web process serves every request, on many threads. Analysis already
+# runs in its own pool of processes (ANALYSIS_WORKERS in app.py).
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Import the app, OpenCV and NumPy once in the master. The web worker, and the
+# analysis workers forked from it, start with them already loaded.
+preload_app = True
+
+# Uploads of up to 100MB on slow connections
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = 30
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """Warm up the analysis code and workers before accepting the first connection"""
+    from app import startup_timings, warm_up
+    warm_up()
+    startup_timings['ready_seconds'] = time.time() - _started
+    worker.log.info(f"Ready to serve {startup_timings['ready_seconds']:.2f}s after boot")
@@ -0,0 +1,270 @@
+"""Background job queue that runs video analysis in a pool of worker processes.
+
+The Flask request only enqueues work and returns a job ID; the page then polls
+the job for progress and fetches the result once it is done.
+"""
+
+import collections
+import cProfile
+import functools
+import io
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from metrics import REGISTRY
+
+# Finished jobs are forgotten after this long, or once more than
+# MAX_FINISHED_JOBS have finished since; their results stay in the result
+# cache and results store
+FINISHED_JOB_TTL_SECONDS = 3600
+MAX_FINISHED_JOBS = 1000
+
+# Set in each worker process by _init_worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _report_progress(job_id, progress):
+    _progress_queue.put((job_id, progress))
+
+
+def _run_job(job_id, fn, args, kwargs, profile=False):
+    """Run one job inside a worker process, forwarding progress to the parent
+
+    Returns (result, metrics snapshot, profile report or None). The profile
+    only covers this thread, not the decoding and detection threads.
+    """
+    _progress_queue.put((job_id, None))
+    REGISTRY.reset()
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        result = fn(*args, progress_callback=functools.partial(_report_progress, job_id), **kwargs)
+    finally:
+        if profiler:
+            profiler.disable()
+
+    report = None
+    if profiler:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+        report = stream.getvalue()
+    return result, REGISTRY.snapshot(), report
+
+
+class JobQueue:
+    def __init__(self, max_workers=None, finished_ttl=FINISHED_JOB_TTL_SECONDS, max_finished=MAX_FINISHED_JOBS):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        # IDs of queued and running jobs, and of finished ones by finishing time
+        self._active = set()
+        self._finished = collections.OrderedDict()
+        # on_complete callbacks of requests that joined an active job
+        self._joined = collections.defaultdict(list)
+        # Notified whenever a job record changes, for clients streaming updates
+        self._lock = threading.Condition()
+        self._executor = None
+        self._progress_queue = None
+
+    def _start(self):
+        """Create the process pool on first use so importing the app stays cheap"""
+        if self._progress_queue is None:
+            self._progress_queue = multiprocessing.Queue()
+            listener = threading.Thread(target=self._listen, daemon=True)
+            listener.start()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             initializer=_init_worker,
+                                             initargs=(self._progress_queue,))
+
+    def _listen(self):
+        """Apply progress and lap events sent by the workers to the job records"""
+        while True:
+            job_id, event = self._progress_queue.get()
+            with self._lock:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] not in ('queued', 'running'):
+                    continue
+                if job['status'] == 'queued':
+                    job['status'] = 'running'
+                    job['started_at'] = datetime.now().isoformat()
+                if event and event.get('event') == 'lap':
+                    job['laps'].append({key: value for key, value in event.items() if key != 'event'})
+                elif event:
+                    job['progress'].update({key: value for key, value in event.items() if key != 'event'})
+                self._changed(job)
+
+    def _changed(self, job):
+        job['version'] += 1
+        self._lock.notify_all()
+
+    def warm_up(self, fn):
+        """Start every worker process and run fn() in each, so the first job finds them ready
+
+        fn must be a module-level function. Blocks until every worker has run it.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._start()
+            # The pool starts a new process for each task while none is idle
+            futures = [self._executor.submit(fn) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def submit(self, fn, *args, on_complete=None, metadata=None, profile=False, **kwargs):
+        """Queue fn(*args, **kwargs) and return the new job ID
+
+        fn must be a module-level function that accepts a progress_callback
+        keyword. on_complete is called in this process with the result dict and
+        may return a replacement for it (e.g. after saving it to disk). With
+        profile, a cProfile report of the job is kept for get_profile().
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'progress': {},
+            'laps': [],
+            'version': 0,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+            'result': None,
+            'profile': None,
+        }
+        job.update(metadata or {})
+
+        with self._lock:
+            self._forget_finished()
+            self.jobs[job_id] = job
+            self._active.add(job_id)
+            if self._executor is None:
+                self._start()
+            try:
+                future = self._executor.submit(_run_job, job_id, fn, args, kwargs, profile)
+            except BrokenProcessPool:
+                print("Worker pool is broken, restarting it")
+                self._start()
+                future = self._executor.submit(_run_job, job_id, fn, args, kwargs, profile)
+
+        future.add_done_callback(functools.partial(self._finish, job_id, on_complete))
+        return job_id
+
+    def _finish(self, job_id, on_complete, future):
+        report = None
+        # Nothing can join the job once it is no longer active
+        with self._lock:
+            self._active.discard(job_id)
+            joined = self._joined.pop(job_id, [])
+        try:
+            result, snapshot, report = future.result()
+            REGISTRY.merge(snapshot)
+            if 'error' not in result:
+                for callback in joined:
+                    try:
+                        callback(result)
+                    except Exception as e:
+                        print(f"Error completing job {job_id} for a joined request: {str(e)}")
+                if on_complete:
+                    result = on_complete(result)
+        except Exception as e:
+            print(f"Error in job {job_id}: {str(e)}")
+            result = {'error': f'Video processing error: {str(e)}'}
+
+        with self._lock:
+            job = self.jobs[job_id]
+            job['finished_at'] = datetime.now().isoformat()
+            job['result'] = result
+            job['profile'] = report
+            if 'error' in result:
+                job['status'] = 'failed'
+                job['error'] = result['error']
+            else:
+                job['status'] = 'completed'
+            REGISTRY.increment('jobs_finished_total', status=job['status'])
+            self._finished[job_id] = time.monotonic()
+            self._changed(job)
+            self._forget_finished()
+
+    def _forget_finished(self):
+        """Drop the records of jobs that finished over finished_ttl ago, and the oldest beyond max_finished"""
+        expired = time.monotonic() - self.finished_ttl
+        while self._finished:
+            job_id, finished = next(iter(self._finished.items()))
+            if finished > expired and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[job_id]
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        """Return a copy of the job record without its result, or None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {key: value for key, value in job.items() if key not in ('result', 'profile')}
+            status['progress'] = dict(job['progress'])
+            status['laps'] = list(job['laps'])
+            return status
+
+    def wait_for_update(self, job_id, version, timeout=None):
+        """Block until the job's version differs from version, then return get(job_id)
+
+        Returns the unchanged record if timeout expires first, or None for an
+        unknown job.
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self.jobs.get(job_id, {}).get('version') != version, timeout)
+            return self.get(job_id)
+
+    def find_active(self, **metadata):
+        """Return the ID of a queued or running job with matching metadata, or None"""
+        with self._lock:
+            for job_id in self._active:
+                job = self.jobs[job_id]
+                if all(job.get(key) == value for key, value in metadata.items()):
+                    return job_id
+        return None
+
+    def join_active(self, on_complete, **metadata):
+        """Return the ID of an active job like find_active, also calling on_complete with its result
+
+        For a request that wants the same work done as an active job but
+        records the result its own way. on_complete is called in this process
+        before the job's own on_complete; its return value is ignored.
+        """
+        with self._lock:
+            job_id = self.find_active(**metadata)
+            if job_id is not None:
+                self._joined[job_id].append(on_complete)
+            return job_id
+
+    def get_result(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return job['result'] if job else None
+
+    def get_profile(self, job_id):
+        """cProfile report of a finished job submitted with profile, or None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return job['profile'] if job else None
+
+    def queue_depth(self):
+        """Number of jobs that are waiting for or using a worker"""
+        with self._lock:
+            return len(self._active)
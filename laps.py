@@ -0,0 +1,164 @@
+"""Lap detection over a whole centroid track at once.
+
+Tracking only records where the athlete was in each frame. Lap crossings
+are then found with a few NumPy array operations over the full track, so
+they can be recomputed cheaply for other endpoints or thresholds without
+decoding the video again.
+"""
+
+import numpy as np
+
+# Columns of a CentroidTrack
+FRAME, TIME, X, Y, AREA = range(5)
+
+# Half-width of the band around the endpoints line, as a fraction of the
+# distance between the endpoints. The athlete has to leave the band on the
+# other side before a crossing counts, so centroid jitter around the line is
+# not counted as laps.
+LINE_HYSTERESIS = 0.05
+
+# A crossing also only counts once the athlete has stayed on the new side for
+# this many seconds, which drops the centroid briefly jumping to another blob
+MIN_SIDE_SECONDS = 0.5
+
+
+class CentroidTrack:
+    """Preallocated array of (frame_number, time, x, y, area) rows, one per detection"""
+
+    def __init__(self, capacity=1024):
+        self._rows = np.empty((max(capacity, 1), 5), dtype=np.float64)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, frame_number, time, x, y, area):
+        if self._length == len(self._rows):
+            # Frame counts reported by containers are only estimates
+            self._rows = np.concatenate([self._rows, np.empty_like(self._rows)])
+        self._rows[self._length] = (frame_number, time, x, y, area)
+        self._length += 1
+
+    @property
+    def rows(self):
+        """View of the filled rows"""
+        return self._rows[:self._length]
+
+
+def signed_line_distances(points, endpoints):
+    """Signed perpendicular distances in pixels from each (x, y) point to the endpoints line"""
+    (x1, y1), (x2, y2) = endpoints[0], endpoints[1]
+    length = np.hypot(x2 - x1, y2 - y1)
+    if length == 0:
+        return np.zeros(len(points))
+    return ((x2 - x1) * (points[:, 1] - y1) - (y2 - y1) * (points[:, 0] - x1)) / length
+
+
+def _carry_forward(state):
+    """Replace zeros with the last non-zero value before them (zero if none)"""
+    indices = np.arange(len(state))
+    last_set = np.maximum.accumulate(np.where(state != 0, indices, -1))
+    return np.where(last_set >= 0, state[np.maximum(last_set, 0)], 0)
+
+
+def find_line_crossings(rows, endpoints, hysteresis=LINE_HYSTERESIS, min_side_seconds=MIN_SIDE_SECONDS):
+    """Times at which the athlete crossed the line between the endpoints
+
+    rows is an array of CentroidTrack rows. A crossing only counts once the
+    athlete is more than the hysteresis band away from the line on the other
+    side and stays on that side for min_side_seconds. Its time is
+    interpolated to where the centroid path meets the line between two
+    frames. Crossings found for a track never change when more rows are
+    appended to it.
+    """
+    return _crossings_and_flips(rows, endpoints, hysteresis, min_side_seconds)[0]
+
+
+def _crossings_and_flips(rows, endpoints, hysteresis, min_side_seconds):
+    """find_line_crossings, plus the row at which each crossing was confirmed
+
+    That row starts the athlete's settled visit to the new side, so a track
+    sliced from it finds exactly the crossings after this one.
+    """
+    if len(rows) < 2 or len(endpoints) < 2:
+        return np.empty(0), np.empty(0, dtype=np.intp)
+
+    times = rows[:, TIME]
+    distances = signed_line_distances(rows[:, [X, Y]], endpoints)
+    band = hysteresis * np.hypot(endpoints[1][0] - endpoints[0][0], endpoints[1][1] - endpoints[0][1])
+
+    # Side of the line outside the band (+1/-1), carried forward through the band
+    state = np.where(distances > band, 1, np.where(distances < -band, -1, 0))
+    settled = _carry_forward(state)
+
+    # Drop visits to a side that are too short, including a visit still in
+    # progress at the end of the track, and carry the previous side over them
+    starts = np.nonzero(np.diff(settled, prepend=0) != 0)[0]
+    if len(starts) == 0:
+        # Never left the band around the line
+        return np.empty(0), np.empty(0, dtype=np.intp)
+    durations = np.append(times[starts[1:]], times[-1]) - times[starts]
+    visit = np.cumsum(np.isin(np.arange(len(state)), starts)) - 1
+    too_short = (visit >= 0) & (durations[np.maximum(visit, 0)] < min_side_seconds)
+    settled = _carry_forward(np.where(too_short, 0, state))
+
+    flips = np.nonzero((settled[1:] != settled[:-1]) & (settled[:-1] != 0))[0] + 1
+    if len(flips) == 0:
+        return np.empty(0), flips
+
+    # The crossing itself is the last change of side at or before each flip
+    sides = np.where(distances >= 0, 1, -1)
+    changes = np.nonzero(sides[1:] != sides[:-1])[0] + 1
+    after = changes[np.searchsorted(changes, flips, side='right') - 1]
+    before = after - 1
+    fraction = distances[before] / (distances[before] - distances[after])
+    return times[before] + fraction * (times[after] - times[before]), flips
+
+
+class LineCrossings:
+    """find_line_crossings for a track that keeps growing, checked again and again
+
+    Each update only looks at the rows from the one that confirmed the last
+    crossing onwards: the athlete is settled on one side of the line there,
+    and the next crossing has to start from it, so earlier rows cannot
+    change what is found. Checking a whole video this way costs about as
+    much as one pass over it, however often it is checked.
+    """
+
+    def __init__(self, endpoints, hysteresis=LINE_HYSTERESIS, min_side_seconds=MIN_SIDE_SECONDS):
+        self.endpoints = endpoints
+        self.hysteresis = hysteresis
+        self.min_side_seconds = min_side_seconds
+        self._crossings = np.empty(0)
+        self._start = 0
+
+    def update(self, rows):
+        """Crossing times over rows, the same track as the last call with rows appended"""
+        crossings, flips = _crossings_and_flips(rows[self._start:], self.endpoints, self.hysteresis,
+                                                self.min_side_seconds)
+        if len(flips):
+            self._crossings = np.concatenate([self._crossings, crossings])
+            self._start += int(flips[-1])
+        return self._crossings
+
+
+def lap_results(crossings, target_laps, duration):
+    """Lap count and lap times from crossing times
+
+    The first crossing starts the clock and every later one completes a lap.
+    If fewer than target_laps crossings happened, the time from the last one
+    to the end of the video counts as a final lap.
+    """
+    crossings = np.asarray(crossings)[:target_laps]
+    lap_times = np.diff(crossings).tolist()
+    total_laps = len(crossings)
+    if total_laps < target_laps and total_laps and crossings[-1] > 0:
+        lap_times.append(duration - float(crossings[-1]))
+        total_laps += 1
+    return total_laps, lap_times
+
+
+def last_lap_unfinished(crossings, target_laps):
+    """True if lap_results counted the time after the last crossing as an unfinished final lap"""
+    crossings = np.asarray(crossings)[:target_laps]
+    return bool(0 < len(crossings) < target_laps and crossings[-1] > 0)
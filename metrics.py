@@ -0,0 +1,107 @@
+"""Stage timings and counters, exported in the Prometheus text format.
+
+Each process records into its own registry, REGISTRY. Analysis workers send
+a snapshot of theirs back with every job result and the web process merges
+it into its own, so /metrics covers every stage wherever it ran.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'shuttlerun'
+
+# Upper bounds in seconds of the stage histogram buckets, from a single
+# frame's colour conversion up to a whole analysis
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # stage -> {'buckets': per-bucket counts (last one is +Inf), 'sum', 'count'}
+            self.stages = {}
+            # (name, sorted label items) -> value
+            self.counters = {}
+
+    def observe(self, stage, seconds):
+        """Record that one run of stage took seconds"""
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            entry['buckets'][index] += 1
+            entry['sum'] += seconds
+            entry['count'] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the body of a with block as one run of stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Picklable copy of everything recorded so far"""
+        with self._lock:
+            return {
+                'stages': {stage: {'buckets': list(entry['buckets']), 'sum': entry['sum'], 'count': entry['count']}
+                           for stage, entry in self.stages.items()},
+                'counters': dict(self.counters)
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot from another registry, e.g. a worker process's, to this one"""
+        with self._lock:
+            for stage, other in snapshot['stages'].items():
+                entry = self.stages.get(stage)
+                if entry is None:
+                    entry = self.stages[stage] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+                entry['sum'] += other['sum']
+                entry['count'] += other['count']
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def prometheus(self, gauges=None):
+        """Everything recorded, plus the given {name: value} gauges, in the Prometheus text format"""
+        snapshot = self.snapshot()
+        lines = [f'# HELP {PREFIX}_stage_seconds Time spent in each stage of uploading and analysing videos',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        for stage, entry in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), entry['buckets']):
+                cumulative += count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+        typed = set()
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            if name not in typed:
+                lines.append(f'# TYPE {PREFIX}_{name} counter')
+                typed.add(name)
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f'{PREFIX}_{name}{{{label_text}}} {value}' if label_text else f'{PREFIX}_{name} {value}')
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            lines.append(f'{PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Metrics()
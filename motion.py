@@ -0,0 +1,126 @@
+"""Athlete detection against an adaptive background model.
+
+Only the lane around the endpoints is converted and differenced, at the
+tracking resolution, and every intermediate image is written into buffers
+allocated once per video. The background is a running average that keeps
+learning from pixels where nothing moved, so gradual lighting changes do
+not turn into false motion.
+"""
+
+import hashlib
+
+import cv2
+import numpy as np
+
+from metrics import REGISTRY
+
+# Gray level change that counts as motion
+MOTION_THRESHOLD = 30
+
+# Weight of each new frame in the running-average background
+BACKGROUND_LEARNING_RATE = 0.02
+
+# The lane extends this many endpoint distances beyond the endpoints on
+# every side; the athlete has to clear the line's hysteresis band by a wide
+# margin, so it must fit comfortably inside
+CORRIDOR_MARGIN = 0.5
+
+
+def corridor_roi(endpoints, width, height, margin=CORRIDOR_MARGIN):
+    """(x0, y0, x1, y1) box around the first two endpoints, clipped to the frame"""
+    (ex1, ey1), (ex2, ey2) = endpoints[0], endpoints[1]
+    pad = margin * np.hypot(ex2 - ex1, ey2 - ey1)
+    x0 = max(0, int(min(ex1, ex2) - pad))
+    y0 = max(0, int(min(ey1, ey2) - pad))
+    x1 = min(width, int(np.ceil(max(ex1, ex2) + pad)))
+    y1 = min(height, int(np.ceil(max(ey1, ey2) + pad)))
+    if x1 <= x0 or y1 <= y0:
+        return 0, 0, width, height
+    return x0, y0, x1, y1
+
+
+class MotionDetector:
+    """Moving blobs per frame, compared with a background learnt from earlier frames
+
+    prepare() only touches the scratch buffers it is given, so it can run on
+    several threads at once. detect() updates the background and must see
+    the frames one at a time, in order.
+    """
+
+    def __init__(self, first_frame, roi, scale=1.0, min_contour_area=0,
+                 threshold=MOTION_THRESHOLD, learning_rate=BACKGROUND_LEARNING_RATE):
+        self.roi = roi
+        self.scale = scale
+        self.min_contour_area = min_contour_area
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        x0, y0, x1, y1 = roi
+        self.size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+
+        self._buffers = self.new_buffers()
+        gray = self.prepare(first_frame, self._buffers)
+        self._background = gray.astype(np.float32)
+        self._background_gray = gray.copy()
+        self._diff = np.empty_like(gray)
+        self._moving = np.empty_like(gray)
+        self._still = np.empty_like(gray)
+
+    def new_buffers(self):
+        """Scratch buffers for prepare(); each thread calling it needs its own"""
+        x0, y0, x1, y1 = self.roi
+        lane = np.empty((y1 - y0, x1 - x0), dtype=np.uint8)
+        if self.size == (x1 - x0, y1 - y0):
+            return lane, None
+        return lane, np.empty((self.size[1], self.size[0]), dtype=np.uint8)
+
+    def prepare(self, frame, buffers):
+        """Grayscale lane of a frame at the tracking resolution, written into buffers"""
+        x0, y0, x1, y1 = self.roi
+        lane, small = buffers
+        with REGISTRY.timer('color_convert'):
+            cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY, dst=lane)
+        if small is None:
+            return lane
+        with REGISTRY.timer('resize'):
+            cv2.resize(lane, self.size, dst=small, interpolation=cv2.INTER_AREA)
+        return small
+
+    def detect(self, gray):
+        """Find the moving blobs in a prepared frame, then learn the background from it
+
+        Returns a list of (cx, cy, area) in full-resolution pixels for every
+        blob larger than min_contour_area, largest (most likely the athlete)
+        first.
+        """
+        with REGISTRY.timer('difference'):
+            cv2.absdiff(self._background_gray, gray, dst=self._diff)
+            cv2.threshold(self._diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self._moving)
+        with REGISTRY.timer('find_contours'):
+            contours, _ = cv2.findContours(self._moving, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        blobs = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area > self.min_contour_area:  # Filter small movements
+                with REGISTRY.timer('moments'):
+                    M = cv2.moments(contour)
+                if M["m00"] != 0:
+                    cx = int(self.roi[0] + M["m10"] / M["m00"] / self.scale)
+                    cy = int(self.roi[1] + M["m01"] / M["m00"] / self.scale)
+                    blobs.append((cx, cy, area / (self.scale * self.scale)))
+        blobs.sort(key=lambda blob: blob[2], reverse=True)
+
+        # Moving pixels are left out so the athlete never fades into the background
+        with REGISTRY.timer('background_update'):
+            cv2.bitwise_not(self._moving, dst=self._still)
+            cv2.accumulateWeighted(gray, self._background, self.learning_rate, mask=self._still)
+            cv2.convertScaleAbs(self._background, dst=self._background_gray)
+        return blobs
+
+    def state_digest(self):
+        """Digest of the background model; detectors with equal digests find the same blobs from here on"""
+        return hashlib.sha1(self._background.tobytes()).hexdigest()
+
+    def detect_frame(self, frame):
+        """prepare() and detect() a frame using the detector's own buffers"""
+        return self.detect(self.prepare(frame, self._buffers))
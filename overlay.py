@@ -0,0 +1,232 @@
+"""Annotated overlay videos showing where laps were counted.
+
+The overlay is rendered from the frames tracking already decodes. Each one
+is downscaled and handed through a bounded queue to an encoder thread, which
+draws the endpoints line, the tracked centroid with its recent path and a
+marker where each lap was counted, then encodes it. A crossing is only found
+a while after the athlete crosses the line, so the encoder holds each frame
+back until lap detection has run far enough past it.
+"""
+
+import collections
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from atomic_write import temp_path, write_bytes_atomic
+from laps import MIN_SIDE_SECONDS
+from metrics import REGISTRY
+
+# Overlays are rendered at most this wide
+OVERLAY_MAX_WIDTH = 480
+
+# Encoders to try in order, with the file extension each is written with:
+# H.264 MP4 where OpenCV's FFmpeg has it, otherwise VP8 WebM, which browsers
+# also play, and MPEG-4 Part 2 MP4 as a last resort
+OVERLAY_CODECS = (('avc1', '.mp4'), ('VP80', '.webm'), ('mp4v', '.mp4'))
+
+# Seconds of centroid path drawn behind the athlete
+TRAIL_SECONDS = 1.0
+
+# Seconds the lap banner and the line stay highlighted after a lap
+LAP_FLASH_SECONDS = 1.0
+
+# Seconds lap detection must have run past a frame before it is drawn;
+# covers the time a crossing takes to be confirmed
+LAP_DELAY_SECONDS = MIN_SIDE_SECONDS + 0.5
+
+LINE_COLOR = (0, 220, 255)
+FLASH_COLOR = (0, 0, 255)
+CENTROID_COLOR = (0, 255, 0)
+MARKER_COLOR = (255, 0, 255)
+
+
+def overlay_parameters():
+    """The settings that change how an overlay looks, e.g. for cache keys"""
+    return {'max_width': OVERLAY_MAX_WIDTH, 'trail_seconds': TRAIL_SECONDS,
+            'lap_flash_seconds': LAP_FLASH_SECONDS}
+
+
+class OverlayWriter:
+    """Draws and encodes an overlay on a background thread as frames are tracked
+
+    base_path is the output path without an extension; the extension depends
+    on the encoder found. Raises RuntimeError if no encoder can be opened.
+    """
+
+    def __init__(self, base_path, fps, frame_size, endpoints, target_laps, lap_check_frames):
+        width, height = frame_size
+        self.scale = min(1.0, OVERLAY_MAX_WIDTH / width)
+        # Encoders want even dimensions
+        self.size = (int(width * self.scale) // 2 * 2, int(height * self.scale) // 2 * 2)
+        self.fps = fps
+        self.endpoints = [(int(round(x * self.scale)), int(round(y * self.scale))) for x, y in endpoints[:2]]
+        self.target_laps = target_laps
+
+        directory = os.path.dirname(base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer = None
+        for fourcc, extension in OVERLAY_CODECS:
+            video_temp_path = temp_path(base_path, extension)
+            writer = cv2.VideoWriter(video_temp_path, cv2.VideoWriter_fourcc(*fourcc), fps, self.size)
+            if writer.isOpened():
+                self._writer, self.codec, self._temp_path = writer, fourcc, video_temp_path
+                self.path = base_path + extension
+                break
+            writer.release()
+            _remove(video_temp_path)
+        if self._writer is None:
+            raise RuntimeError('No video encoder is available for overlays')
+        self.thumbnail_path = base_path + '.jpg'
+
+        # Holds enough frames for lap detection to run LAP_DELAY_SECONDS ahead
+        # of the encoder, so the tracking loop only waits on a slow encoder
+        self._queue = queue.Queue(maxsize=int(LAP_DELAY_SECONDS * fps) + lap_check_frames + 8)
+        self._condition = threading.Condition()
+        self._crossings = np.empty(0)
+        self._checked_until = -1.0
+        self._error = None
+        self._written = 0
+        self._last_image = None
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def scaled(self, frame):
+        """A downscaled copy of a decoded frame, which may be reused once this returns"""
+        if frame.shape[1::-1] == self.size:
+            return frame.copy()
+        return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+
+    def add(self, frame_number, picture, centroid):
+        """Queue a scaled frame and the main athlete's (x, y) centroid in it, or None
+
+        Frames must come in order; frames skipped between two are filled with
+        the earlier one. Blocks while the queue is full.
+        """
+        self._queue.put((frame_number, picture, centroid))
+
+    def update_laps(self, crossings, checked_until):
+        """Line crossing times found by lap detection over the track up to checked_until seconds"""
+        with self._condition:
+            self._crossings = crossings
+            self._checked_until = checked_until
+            self._condition.notify_all()
+
+    def close(self, crossings):
+        """Finish the overlay with the final crossings and move it into place
+
+        Returns {'file', 'thumbnail', 'codec', 'size', 'frames'}, or
+        {'error'} if encoding failed.
+        """
+        self.update_laps(crossings, float('inf'))
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.release()
+        if self._error is not None or self._last_image is None:
+            _remove(self._temp_path)
+            return {'error': f'Overlay rendering failed: {self._error or "no frames"}'}
+
+        os.replace(self._temp_path, self.path)
+        ok, jpeg = cv2.imencode('.jpg', self._last_image)
+        if ok:
+            write_bytes_atomic(self.thumbnail_path, jpeg.tobytes())
+        print(f"Wrote {self._written} overlay frame(s) to {self.path}")
+        return {'file': os.path.basename(self.path),
+                'thumbnail': os.path.basename(self.thumbnail_path) if ok else None,
+                'codec': self.codec, 'size': list(self.size), 'frames': self._written}
+
+    def abort(self):
+        """Stop the encoder and delete the partial overlay"""
+        with self._condition:
+            self._error = self._error or 'aborted'
+            self._condition.notify_all()
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.release()
+        _remove(self._temp_path)
+
+    def _wait_for_laps(self, time):
+        """The crossings known once lap detection has checked LAP_DELAY_SECONDS past time"""
+        with self._condition:
+            # A full queue means the tracking loop is waiting on this thread
+            while (self._checked_until < time + LAP_DELAY_SECONDS and self._error is None
+                   and not self._queue.full()):
+                self._condition.wait(0.05)
+            return self._crossings
+
+    def _encode(self):
+        trail = collections.deque()
+        markers = []
+        last_frame = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep draining so the tracking loop never blocks
+                continue
+            frame_number, image, centroid = item
+            time = frame_number / self.fps
+            try:
+                crossings = self._wait_for_laps(time)
+                with REGISTRY.timer('overlay_encode'):
+                    if centroid is not None:
+                        trail.append((time, (int(round(centroid[0] * self.scale)),
+                                             int(round(centroid[1] * self.scale)))))
+                    while trail and trail[0][0] < time - TRAIL_SECONDS:
+                        trail.popleft()
+                    laps = min(int(np.searchsorted(crossings, time, side='right')), self.target_laps)
+                    # A lap's marker goes where the athlete is when it is counted
+                    while len(markers) < laps and trail:
+                        markers.append(trail[-1][1])
+                    self._draw(image, time, crossings, laps, trail, markers)
+
+                    # Repeat the previous frame over frames tracking skipped
+                    if last_frame is not None:
+                        for _ in range(frame_number - last_frame - 1):
+                            self._writer.write(self._last_image)
+                            self._written += 1
+                    self._writer.write(image)
+                    self._written += 1
+                    self._last_image = image
+                    last_frame = frame_number
+            except Exception as e:
+                print(f"Error rendering overlay: {str(e)}")
+                self._error = str(e)
+
+    def _draw(self, image, time, crossings, laps, trail, markers):
+        flashing = laps > 0 and time - crossings[laps - 1] < LAP_FLASH_SECONDS
+        line_color = FLASH_COLOR if flashing else LINE_COLOR
+        cv2.line(image, self.endpoints[0], self.endpoints[1], line_color, 2, cv2.LINE_AA)
+        for point in self.endpoints:
+            cv2.circle(image, point, 5, line_color, -1, cv2.LINE_AA)
+
+        for lap, point in enumerate(markers, start=1):
+            # Laps counted at the same spot get their numbers stacked upwards
+            below = sum(abs(x - point[0]) + abs(y - point[1]) < 16 for x, y in markers[:lap - 1])
+            cv2.circle(image, point, 7, MARKER_COLOR, 2, cv2.LINE_AA)
+            cv2.putText(image, str(lap), (point[0] + 9, point[1] - 9 - 14 * below), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.45, MARKER_COLOR, 1, cv2.LINE_AA)
+
+        if len(trail) > 1:
+            cv2.polylines(image, [np.array([point for _, point in trail], dtype=np.int32)], False,
+                          CENTROID_COLOR, 1, cv2.LINE_AA)
+        if trail and trail[-1][0] == time:
+            cv2.circle(image, trail[-1][1], 5, CENTROID_COLOR, -1, cv2.LINE_AA)
+
+        cv2.putText(image, f'Lap {laps}/{self.target_laps}  {time:.2f}s', (10, 22),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
+        if flashing:
+            cv2.putText(image, f'LAP {laps}', (10, 52), cv2.FONT_HERSHEY_SIMPLEX, 0.9, FLASH_COLOR, 2,
+                        cv2.LINE_AA)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,200 @@
+"""On-disk cache of analysis results keyed by video content and parameters.
+
+A re-upload of the same clip with the same settings is answered from the
+cache, and clips that share a filename no longer overwrite each other's
+results. The cache is bounded in size and evicts the least recently used
+results first, along with files that belong to them such as overlay
+videos. The motion track behind a result can be stored beside it, so
+other lap counts, distances or endpoints can be computed without decoding
+the video again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from atomic_write import write_json_atomic, write_npy_atomic
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(video_hash, parameters):
+    """Cache key for a video's content hash and its analysis parameters"""
+    payload = json.dumps({'video': video_hash, 'parameters': parameters}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        self._index_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """(Re)read the index if another process has changed it since we last did"""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime == self._index_mtime:
+            return
+
+        # 'entries' maps cache keys to their size, last access time and kind
+        # (results, or motion tracks with kind 'track'), 'filenames' maps
+        # upload filenames to the key of their latest result
+        self.index = {'entries': {}, 'filenames': {}}
+        if mtime is not None:
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading result cache index, starting empty: {str(e)}")
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        write_json_atomic(self.index_path, self.index)
+        self._index_mtime = os.path.getmtime(self.index_path)
+
+    def _result_path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _track_paths(self, key):
+        return (os.path.join(self.directory, f'{key}.track.npy'),
+                os.path.join(self.directory, f'{key}.track.json'),
+                os.path.join(self.directory, f'{key}.athletes.npy'))
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        with self._lock:
+            self._load_index()
+            entry = self.index['entries'].get(key)
+            if entry is None or entry.get('kind') == 'track':
+                return None
+            try:
+                with open(self._result_path(key), 'r') as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                self._save_index()
+                return None
+            entry['last_access'] = time.time()
+            self._save_index()
+            return result
+
+    def get_by_filename(self, filename):
+        """Return the latest cached result uploaded under filename, or None"""
+        with self._lock:
+            self._load_index()
+            key = self.index['filenames'].get(filename)
+        return self.get(key) if key else None
+
+    def put(self, key, result, filename=None, files=()):
+        """Store a result, point filename at it and evict old results if over budget
+
+        files are paths of other files that belong to the result, such as its
+        overlay video; they count towards the budget and are deleted with it.
+        """
+        with self._lock:
+            self._load_index()
+            path = self._result_path(key)
+            write_json_atomic(path, result)
+            files = [file for file in files if os.path.isfile(file)]
+            self.index['entries'][key] = {
+                'size': os.path.getsize(path) + sum(os.path.getsize(file) for file in files),
+                'last_access': time.time()
+            }
+            if files:
+                self.index['entries'][key]['files'] = files
+            if filename:
+                self.index['filenames'][filename] = key
+            self._evict()
+            self._save_index()
+
+    def get_track(self, key):
+        """Return (rows, metadata, athlete_rows) for a stored motion track, or None
+
+        The arrays are memory-mapped read-only from the cache files;
+        athlete_rows is None unless it was stored.
+        """
+        with self._lock:
+            self._load_index()
+            entry = self.index['entries'].get(key)
+            if entry is None or entry.get('kind') != 'track':
+                return None
+            rows_path, metadata_path, athletes_path = self._track_paths(key)
+            try:
+                rows = np.load(rows_path, mmap_mode='r')
+                with open(metadata_path, 'r') as f:
+                    metadata = json.load(f)
+                athlete_rows = np.load(athletes_path, mmap_mode='r') if entry.get('athletes') else None
+            except (OSError, ValueError):
+                self._remove(key)
+                self._save_index()
+                return None
+            entry['last_access'] = time.time()
+            self._save_index()
+            return rows, metadata, athlete_rows
+
+    def put_track(self, key, rows, metadata, athlete_rows=None):
+        """Store a motion track and its metadata under key, within the same size budget"""
+        with self._lock:
+            self._load_index()
+            rows_path, metadata_path, athletes_path = self._track_paths(key)
+            write_npy_atomic(rows_path, rows)
+            write_json_atomic(metadata_path, metadata)
+            size = os.path.getsize(rows_path) + os.path.getsize(metadata_path)
+            if athlete_rows is not None:
+                write_npy_atomic(athletes_path, athlete_rows)
+                size += os.path.getsize(athletes_path)
+            self.index['entries'][key] = {
+                'size': size,
+                'last_access': time.time(),
+                'kind': 'track',
+                'athletes': athlete_rows is not None
+            }
+            self._evict()
+            self._save_index()
+
+    def link_filename(self, filename, key):
+        """Point filename at an existing result, e.g. after a cache hit"""
+        with self._lock:
+            self._load_index()
+            if key in self.index['entries']:
+                self.index['filenames'][filename] = key
+                self._save_index()
+
+    def _evict(self):
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        # Always keep the newest entry, even if it alone is over budget
+        while total > self.max_bytes and len(entries) > 1:
+            oldest = min(entries, key=lambda key: entries[key]['last_access'])
+            total -= entries[oldest]['size']
+            print(f"Evicting cached {entries[oldest].get('kind', 'result')} {oldest}")
+            self._remove(oldest)
+
+    def _remove(self, key):
+        entry = self.index['entries'].pop(key, None) or {}
+        self.index['filenames'] = {filename: linked for filename, linked in self.index['filenames'].items()
+                                   if linked != key}
+        paths = self._track_paths(key) if entry.get('kind') == 'track' else (self._result_path(key),)
+        for path in list(paths) + entry.get('files', []):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,278 @@
+"""SQLite store of every analysis result, for listing and leaderboards.
+
+Each result is kept whole as JSON next to indexed columns (video hash,
+athlete, session, station and timestamp), so results can be filtered,
+paged and aggregated without reading every result file.
+
+Usage:
+    python results_store.py import static/results
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    result_id TEXT PRIMARY KEY,
+    video_filename TEXT,
+    video_hash TEXT,
+    athlete TEXT,
+    session TEXT,
+    station_id TEXT,
+    analysis_mode TEXT,
+    total_laps INTEGER,
+    target_laps INTEGER,
+    best_lap REAL,
+    distance_meters REAL,
+    duration REAL,
+    timestamp TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp, result_id);
+CREATE INDEX IF NOT EXISTS results_video_hash ON results (video_hash);
+CREATE INDEX IF NOT EXISTS results_video_filename ON results (video_filename, timestamp);
+CREATE INDEX IF NOT EXISTS results_athlete ON results (athlete, timestamp);
+CREATE INDEX IF NOT EXISTS results_session ON results (session, timestamp);
+CREATE INDEX IF NOT EXISTS results_station ON results (station_id, timestamp);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+# Columns returned when listing results; the whole result comes from get()
+SUMMARY_COLUMNS = ('result_id', 'video_filename', 'video_hash', 'athlete', 'session', 'station_id',
+                   'analysis_mode', 'total_laps', 'target_laps', 'best_lap', 'distance_meters',
+                   'duration', 'timestamp')
+
+# Columns results can be filtered on, and aggregated by
+FILTER_COLUMNS = ('athlete', 'session', 'station_id', 'video_hash', 'video_filename')
+GROUP_COLUMNS = ('athlete', 'session', 'station_id', 'video_hash')
+
+MAX_PAGE_SIZE = 500
+
+# Bumped whenever the way best_lap is worked out changes, so stored rows are recomputed
+BEST_LAP_RULE = '2'
+
+# Labels an uploader can tag a result with
+LABEL_COLUMNS = ('athlete', 'session')
+
+
+def labelled_result_id(cache_key, labels):
+    """ID of the stored result for an analysis tagged with labels ({'athlete', 'session'})
+
+    Each set of labels gets a row of its own, so uploads of the same video by
+    different athletes or sessions never replace each other's results.
+    Unlabelled results are stored under the cache key itself.
+    """
+    if not labels:
+        return cache_key
+    payload = json.dumps({'result': cache_key, 'labels': labels}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def ranked_best_lap(result):
+    """The shortest finished lap of a result, or None if it has none that can be ranked
+
+    An unfinished final lap (the time from the last crossing to the end of
+    the video) never counts. Results saved before that was recorded, such as
+    imported ones, may hold a partial lap or the spurious very short laps of
+    the old lap logic, so they are left out of leaderboards.
+    """
+    if 'last_lap_unfinished' not in result:
+        return None
+    lap_times = result.get('lap_times') or []
+    if result['last_lap_unfinished']:
+        lap_times = lap_times[:-1]
+    return min(lap_times) if lap_times else None
+
+
+class ResultsStore:
+    """Results in one SQLite database, safe to share between threads and processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.executescript(SCHEMA)
+        if self.get_meta('best_lap_rule') != BEST_LAP_RULE:
+            self._rank_stored_results()
+
+    def _rank_stored_results(self):
+        """Recompute best_lap for every stored result after BEST_LAP_RULE changed"""
+        db = self._connection()
+        rows = db.execute('SELECT result_id, result FROM results').fetchall()
+        with db:
+            db.executemany('UPDATE results SET best_lap = ? WHERE result_id = ?',
+                           [(ranked_best_lap(json.loads(row['result'])), row['result_id']) for row in rows])
+            db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('best_lap_rule', BEST_LAP_RULE))
+
+    def _connection(self):
+        """This thread's connection; WAL lets readers carry on while a result is written"""
+        db = getattr(self._local, 'db', None)
+        # A connection must not be used on both sides of a fork, e.g. after
+        # gunicorn forks its workers from a preloaded app
+        if db is None or self._local.pid != os.getpid():
+            self._local.pid = os.getpid()
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def put(self, result):
+        """Add a result, or replace the one with the same result_id"""
+        calibration = result.get('calibration') or {}
+        row = {
+            'result_id': result['result_id'],
+            'video_filename': result.get('video_filename'),
+            'video_hash': result.get('video_hash'),
+            'athlete': result.get('athlete'),
+            'session': result.get('session'),
+            'station_id': calibration.get('station_id'),
+            'analysis_mode': result.get('analysis_mode'),
+            'total_laps': result.get('total_laps'),
+            'target_laps': result.get('target_laps'),
+            'best_lap': ranked_best_lap(result),
+            'distance_meters': result.get('distance_meters'),
+            'duration': result.get('duration'),
+            'timestamp': result.get('timestamp') or '',
+            'result': json.dumps(result)
+        }
+        with self._connection() as db:
+            db.execute(f'INSERT OR REPLACE INTO results ({", ".join(row)}) '
+                       f'VALUES ({", ".join("?" * len(row))})', list(row.values()))
+
+    def get(self, result_id):
+        """The whole result with this result_id, or None"""
+        row = self._connection().execute('SELECT result FROM results WHERE result_id = ?',
+                                         (result_id,)).fetchone()
+        return json.loads(row['result']) if row else None
+
+    def get_by_filename(self, filename):
+        """The latest result for a video filename, or None"""
+        row = self._connection().execute(
+            'SELECT result FROM results WHERE video_filename = ? ORDER BY timestamp DESC LIMIT 1',
+            (filename,)).fetchone()
+        return json.loads(row['result']) if row else None
+
+    def _where(self, filters):
+        """SQL condition and values for {column: value} filters plus optional since/until timestamps"""
+        conditions, values = [], []
+        for column in FILTER_COLUMNS:
+            if filters.get(column):
+                conditions.append(f'{column} = ?')
+                values.append(filters[column])
+        if filters.get('since'):
+            conditions.append('timestamp >= ?')
+            values.append(filters['since'])
+        if filters.get('until'):
+            conditions.append('timestamp < ?')
+            values.append(filters['until'])
+        return ' AND '.join(conditions) or '1', values
+
+    def list(self, filters=None, limit=50, cursor=None):
+        """One page of result summaries, newest first
+
+        Returns (summaries, next_cursor). Pages are keyed on the last
+        result's timestamp and ID rather than an offset, so deep pages are as
+        fast as the first; next_cursor is None on the last page.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        condition, values = self._where(filters or {})
+        if cursor:
+            timestamp, _, result_id = cursor.partition('|')
+            condition += ' AND (timestamp < ? OR (timestamp = ? AND result_id < ?))'
+            values += [timestamp, timestamp, result_id]
+        rows = self._connection().execute(
+            f'SELECT {", ".join(SUMMARY_COLUMNS)} FROM results WHERE {condition} '
+            f'ORDER BY timestamp DESC, result_id DESC LIMIT ?', values + [limit + 1]).fetchall()
+        summaries = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = f"{summaries[-1]['timestamp']}|{summaries[-1]['result_id']}"
+        return summaries, next_cursor
+
+    def aggregate(self, group_by, filters=None, limit=50):
+        """Leaderboard of results grouped by athlete, session, station_id or video_hash
+
+        Each group has its result count, best (shortest) lap and the result it
+        came from, most laps, average best lap and latest result time, ordered
+        by best lap.
+        """
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f'group_by must be one of: {", ".join(GROUP_COLUMNS)}')
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        condition, values = self._where(filters or {})
+        # Each group's rows are numbered by best lap, the earliest result
+        # winning a tie, so the best lap's result can be picked out of the group
+        rows = self._connection().execute(
+            f'WITH ranked AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY {group_by} '
+            f'ORDER BY best_lap IS NULL, best_lap, timestamp, result_id) AS lap_rank '
+            f'FROM results WHERE {group_by} IS NOT NULL AND {condition}) '
+            f'SELECT {group_by} AS "group", COUNT(*) AS results, MIN(best_lap) AS best_lap, '
+            f'MAX(CASE WHEN lap_rank = 1 AND best_lap IS NOT NULL THEN result_id END) AS best_result_id, '
+            f'MAX(total_laps) AS most_laps, AVG(best_lap) AS average_best_lap, MAX(timestamp) AS latest '
+            f'FROM ranked GROUP BY {group_by} ORDER BY best_lap IS NULL, best_lap, "group" LIMIT ?',
+            values + [limit]).fetchall()
+        return [dict(row, rank=rank) for rank, row in enumerate(rows, start=1)]
+
+    def get_meta(self, key):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def import_json_results(store, directory):
+    """Add the <filename>_results.json files in directory, and any cached results, to the store
+
+    Results saved before result IDs existed get one derived from their file
+    path. Returns the number of results imported.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*_results.json')))
+    paths += sorted(path for path in glob.glob(os.path.join(directory, 'cache', '*.json'))
+                    if os.path.basename(path) != 'index.json' and not path.endswith('.track.json'))
+    imported = 0
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                result = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {str(e)}")
+            continue
+        if not isinstance(result, dict) or 'error' in result:
+            continue
+        if 'result_id' not in result:
+            result['result_id'] = 'import-' + hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()
+        if 'video_filename' not in result and path.endswith('_results.json'):
+            result['video_filename'] = os.path.basename(path)[:-len('_results.json')]
+        store.put(result)
+        imported += 1
+    return imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the SQLite results store')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    import_parser = subcommands.add_parser('import', help='import <filename>_results.json files')
+    import_parser.add_argument('directory', help='directory of _results.json files, e.g. static/results')
+    import_parser.add_argument('--store', default='static/results/results.db')
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.store)
+    imported = import_json_results(store, args.directory)
+    print(f"Imported {imported} result(s) into {args.store}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the background job queue in jobs.py
+Run with: python -m pytest -q test_jobs.py
+"""
+
+import time
+
+from jobs import JobQueue
+from results_store import labelled_result_id
+
+def slow_analysis(seconds, progress_callback=None):
+    time.sleep(seconds)
+    return {'total_laps': 3}
+
+def wait_until_finished(queue, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while queue.get(job_id)['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_joined_requests_each_get_the_result():
+    """A request joining an active job has its own completion called as well as the submitter's"""
+    queue = JobQueue(max_workers=1)
+    saved = []
+
+    def save(labels, result):
+        saved.append(dict(result, **labels))
+        return saved[-1]
+
+    job_id = queue.submit(slow_analysis, 1.0, on_complete=lambda result: save({'athlete': 'ana'}, result),
+                          metadata={'cache_key': 'key'})
+    assert queue.join_active(lambda result: save({'athlete': 'ben'}, result), cache_key='key') == job_id
+    assert queue.join_active(lambda result: save({}, result), cache_key='other') is None
+    wait_until_finished(queue, job_id)
+
+    assert sorted(result.get('athlete', '') for result in saved) == ['ana', 'ben']
+    assert queue.get_result(job_id) == {'total_laps': 3, 'athlete': 'ana'}
+    # A finished job can no longer be joined
+    assert queue.join_active(lambda result: save({}, result), cache_key='key') is None
+    assert len(saved) == 2
+
+def test_labelled_results_get_their_own_ids():
+    assert labelled_result_id('key', {}) == 'key'
+    assert labelled_result_id('key', {'athlete': 'ana'}) != labelled_result_id('key', {'athlete': 'ben'})
+    assert labelled_result_id('key', {'athlete': 'ana'}) == labelled_result_id('key', {'athlete': 'ana'})
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the vectorized lap detection in laps.py
+Run with: python -m pytest -q test_laps.py
+"""
+
+import numpy as np
+
+from laps import LineCrossings, find_line_crossings, lap_results, last_lap_unfinished
+
+ENDPOINTS = [(0, 200), (400, 200)]
+
+def make_rows(ys, fps=10):
+    """Track rows for a centroid at x=200 moving through the given y positions, one per frame"""
+    return np.array([[frame, frame / fps, 200, y, 900] for frame, y in enumerate(ys)], dtype=np.float64)
+
+def test_track_inside_band_has_no_crossings():
+    """A track that never leaves the band around the line has no crossings instead of failing"""
+    rows = np.array([[1, .1, 100, 200, 900], [2, .2, 110, 201, 900], [3, .3, 120, 202, 900]], dtype=np.float64)
+    assert len(find_line_crossings(rows, ENDPOINTS)) == 0
+
+def test_track_leaving_band_on_one_side_has_no_crossings():
+    """Starting on the line and walking off to one side is not a crossing"""
+    assert len(find_line_crossings(make_rows([200] * 5 + [250] * 10), ENDPOINTS)) == 0
+
+def test_crossing_is_interpolated_to_the_line():
+    """A crossing is timed where the centroid path meets the line"""
+    crossings = find_line_crossings(make_rows([150] * 10 + [250] * 10), ENDPOINTS)
+    assert len(crossings) == 1
+    assert abs(crossings[0] - 0.95) < 1e-9
+
+def test_short_visit_is_not_a_crossing():
+    """A jump to the other side for less than MIN_SIDE_SECONDS does not count"""
+    crossings = find_line_crossings(make_rows([150] * 10 + [250] * 2 + [150] * 10), ENDPOINTS)
+    assert len(crossings) == 0
+
+def test_unfinished_last_lap_is_flagged():
+    """The time after the last crossing is only an unfinished lap when the target wasn't reached"""
+    crossings = [1.0, 3.0, 5.0]
+    assert lap_results(crossings, 5, 6.0) == (4, [2.0, 2.0, 1.0])
+    assert last_lap_unfinished(crossings, 5)
+    assert lap_results(crossings, 3, 6.0) == (3, [2.0, 2.0])
+    assert not last_lap_unfinished(crossings, 3)
+
+def test_incremental_crossings_match_a_full_pass():
+    """Checking a growing track piece by piece finds exactly the crossings of one pass over all of it"""
+    rng = np.random.default_rng(1)
+    # Laps with jitter around the line, brief jumps to the other side and pauses inside the band
+    ys = []
+    for lap in range(12):
+        side = 150 if lap % 2 else 250
+        ys += list(np.linspace(400 - side, side, 20)) + [side] * int(rng.integers(5, 30))
+        ys += [200 + rng.normal(0, 5) for _ in range(int(rng.integers(0, 10)))]
+        if lap % 3 == 0:
+            ys += [400 - side] * 2 + [side] * 10
+    rows = make_rows(ys, fps=30)
+    full = find_line_crossings(rows, ENDPOINTS)
+    assert len(full) >= 10
+
+    live = LineCrossings(ENDPOINTS)
+    for end in range(1, len(rows) + 1, 7):
+        assert np.array_equal(live.update(rows[:end]), find_line_crossings(rows[:end], ENDPOINTS))
+    assert np.array_equal(live.update(rows), full)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
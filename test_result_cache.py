@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for the size-bounded result cache in result_cache.py
+Run with: python -m pytest -q test_result_cache.py
+"""
+
+import os
+import tempfile
+import time
+
+from result_cache import ResultCache
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    return path
+
+def test_result_files_count_towards_the_budget_and_are_evicted_with_it():
+    """An overlay stored with a result is deleted once that result is the least recently used"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(os.path.join(directory, 'cache'), max_bytes=15000)
+        overlay = write_file(os.path.join(directory, 'old.mp4'), 10000)
+        thumbnail = write_file(os.path.join(directory, 'old.jpg'), 1000)
+        cache.put('old', {'total_laps': 1}, 'old.mp4', [overlay, thumbnail])
+        assert cache.index['entries']['old']['size'] > 11000
+        time.sleep(0.01)
+
+        cache.put('new', {'total_laps': 2}, 'new.mp4', [write_file(os.path.join(directory, 'new.mp4'), 10000)])
+        assert cache.get('old') is None
+        assert not os.path.exists(overlay)
+        assert not os.path.exists(thumbnail)
+        assert cache.get('new') == {'total_laps': 2}
+        assert os.path.exists(os.path.join(directory, 'new.mp4'))
+
+def test_results_without_files_are_unchanged():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, max_bytes=1024 * 1024)
+        cache.put('key', {'total_laps': 3}, 'run.mp4', [os.path.join(directory, 'missing.mp4')])
+        assert 'files' not in cache.index['entries']['key']
+        assert cache.get_by_filename('run.mp4') == {'total_laps': 3}
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite results store in results_store.py
+Run with: python -m pytest -q test_results_store.py
+"""
+
+import os
+import tempfile
+
+from results_store import ResultsStore, ranked_best_lap
+
+def make_result(result_id, timestamp, lap_times, athlete='ana', last_lap_unfinished=False):
+    """A stored result with just the fields the store indexes"""
+    return {'result_id': result_id, 'timestamp': timestamp, 'athlete': athlete, 'video_filename': 'run.mp4',
+            'total_laps': len(lap_times), 'target_laps': 5, 'lap_times': lap_times,
+            'last_lap_unfinished': last_lap_unfinished}
+
+def make_store(directory, results):
+    store = ResultsStore(os.path.join(directory, 'results.db'))
+    for result in results:
+        store.put(result)
+    return store
+
+def test_ranked_best_lap_skips_unfinished_last_lap():
+    """The partial lap at the end of an unfinished run never counts as the best lap"""
+    assert ranked_best_lap(make_result('a', '', [6.0, 5.5, 2.0], last_lap_unfinished=True)) == 5.5
+    assert ranked_best_lap(make_result('a', '', [6.0, 5.5, 2.0])) == 2.0
+    assert ranked_best_lap(make_result('a', '', [3.0], last_lap_unfinished=True)) is None
+    assert ranked_best_lap(make_result('a', '', [])) is None
+
+def test_ranked_best_lap_leaves_out_legacy_results():
+    """Results saved before unfinished laps were recorded are not ranked"""
+    assert ranked_best_lap({'result_id': 'old', 'lap_times': [0.04, 6.0]}) is None
+
+def test_aggregate_returns_the_result_holding_the_best_lap():
+    """best_result_id names the result with the group's best lap, not the latest or most laps"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(directory, [
+            make_result('best', '2026-01-01T10:00:00', [6.0, 5.0]),
+            make_result('latest', '2026-01-02T10:00:00', [6.0, 6.5, 7.0]),
+            make_result('other', '2026-01-01T09:00:00', [5.5], athlete='ben')])
+        groups = store.aggregate('athlete')
+        assert [group['group'] for group in groups] == ['ana', 'ben']
+        ana = groups[0]
+        assert ana['best_lap'] == 5.0
+        assert ana['best_result_id'] == 'best'
+        assert ana['results'] == 2
+        assert ana['most_laps'] == 3
+        assert ana['latest'] == '2026-01-02T10:00:00'
+        assert ana['rank'] == 1
+        assert groups[1]['best_result_id'] == 'other'
+
+def test_aggregate_without_a_ranked_lap_has_no_best_result():
+    """A group whose results have no ranked lap sorts last with no best result"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(directory, [
+            make_result('partial', '2026-01-01T10:00:00', [3.0], athlete='cy', last_lap_unfinished=True),
+            make_result('full', '2026-01-01T10:00:00', [5.0])])
+        groups = store.aggregate('athlete')
+        assert [group['group'] for group in groups] == ['ana', 'cy']
+        assert groups[1]['best_lap'] is None
+        assert groups[1]['best_result_id'] is None
+
+def test_aggregate_applies_filters_before_picking_the_best_result():
+    """A best lap outside the filters is neither reported nor linked"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(directory, [
+            make_result('old', '2025-06-01T10:00:00', [4.0]),
+            make_result('new', '2026-01-01T10:00:00', [5.0])])
+        groups = store.aggregate('athlete', {'since': '2026-01-01'})
+        assert groups[0]['best_lap'] == 5.0
+        assert groups[0]['best_result_id'] == 'new'
+
+def test_list_pages_through_every_result_once():
+    """Cursor paging returns each result exactly once, newest first, including timestamp ties"""
+    with tempfile.TemporaryDirectory() as directory:
+        results = [make_result(f'r{i:02d}', f'2026-01-{1 + i // 3:02d}T10:00:00', [5.0]) for i in range(10)]
+        store = make_store(directory, results)
+        seen, cursor, pages = [], None, 0
+        while True:
+            summaries, cursor = store.list(limit=3, cursor=cursor)
+            seen += [summary['result_id'] for summary in summaries]
+            pages += 1
+            if cursor is None:
+                break
+        assert pages == 4
+        assert seen == [f'r{i:02d}' for i in reversed(range(10))]
+
+def test_list_filters_and_stops_on_an_exact_last_page():
+    """A filtered list whose last page is full reports no further cursor"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(directory, [make_result(f'a{i}', f'2026-01-0{i + 1}', [5.0]) for i in range(4)]
+                           + [make_result('b0', '2026-01-09', [5.0], athlete='ben')])
+        summaries, cursor = store.list({'athlete': 'ana'}, limit=2)
+        assert [summary['result_id'] for summary in summaries] == ['a3', 'a2']
+        summaries, cursor = store.list({'athlete': 'ana'}, limit=2, cursor=cursor)
+        assert [summary['result_id'] for summary in summaries] == ['a1', 'a0']
+        assert cursor is None
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Checks that tracking split into parallel segments gives exactly the serial results
+Run with: python -m pytest -q test_segments.py
+"""
+
+import os
+import tempfile
+
+import analyzer
+from benchmark import make_synthetic_video
+
+def analyze(video_path, segment_processes, background_learning_rate):
+    """Laps from analyze_video, and whether the video was actually tracked in segments"""
+    segmented = []
+    track_segments = analyzer.ShuttleRunAnalyzer.track_segments
+
+    def recording_track_segments(self, *args):
+        track = track_segments(self, *args)
+        segmented.append(track is not None)
+        return track
+
+    analyzer.ShuttleRunAnalyzer.track_segments = recording_track_segments
+    try:
+        result = analyzer.analyze_video(video_path, target_laps=20, pipeline_workers=0,
+                                        segment_processes=segment_processes,
+                                        background_learning_rate=background_learning_rate)
+    finally:
+        analyzer.ShuttleRunAnalyzer.track_segments = track_segments
+    assert 'error' not in result
+    assert result['background_learning_rate'] == background_learning_rate
+    return (result['total_laps'], result['lap_times']), any(segmented)
+
+def compare_with_serial(drift, background_learning_rate):
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = os.path.join(directory, 'drift.mp4')
+        make_synthetic_video(video_path, 320, 240, duration=40, laps=8, drift=drift)
+        segmented_laps, segmented = analyze(video_path, 4, background_learning_rate)
+        serial_laps, _ = analyze(video_path, 1, background_learning_rate)
+        assert segmented_laps == serial_laps
+        return segmented
+
+def test_segments_match_serial_under_changing_light():
+    """The adaptive background cannot be split, so segmented tracking falls back to one pass"""
+    assert not compare_with_serial(drift=60, background_learning_rate=analyzer.BACKGROUND_LEARNING_RATE)
+
+def test_segments_match_serial_with_fixed_background():
+    """With a fixed background the video really is split, and every segment starts in the serial state"""
+    assert compare_with_serial(drift=0, background_learning_rate=0)
+
+def test_learning_rate_is_part_of_the_cache_key():
+    """Results tracked against a fixed background are cached apart from adaptive ones"""
+    assert (analyzer.analysis_parameters(5, 20, 'accurate', background_learning_rate=0) !=
+            analyzer.analysis_parameters(5, 20, 'accurate'))
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
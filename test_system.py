@@ -7,24 +7,31 @@ This script demonstrates how to use the system programmatically
 import requests
 import json
 import os
+import re
 import time
 
+def find_test_video():
+    """Name of the video in the uploads directory that the tests upload, or None
+    
+    Skips the copies the app stores under their content hash.
+    """
+    upload_dir = "uploads"
+    video_files = sorted(f for f in os.listdir(upload_dir) if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))
+                         and not re.match(r'^[0-9a-f]{64}\.', f))
+    return video_files[0] if video_files else None
+
 def test_upload_endpoint():
     """Test the upload endpoint with a sample request"""
     url = "http://localhost:5000/upload"
     
     # Check if there are any video files in the uploads directory
-    upload_dir = "uploads"
-    video_files = [f for f in os.listdir(upload_dir) if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))]
-    
-    if not video_files:
+    video_file = find_test_video()
+    if video_file is None:
         print("No video files found in uploads directory.")
         print("Please add a video file to test the system.")
         return False
     
-    # Use the first video file found
-    video_file = video_files[0]
-    video_path = os.path.join(upload_dir, video_file)
+    video_path = os.path.join("uploads", video_file)
     
     print(f"Testing with video file: {video_file}")
     
@@ -37,10 +44,13 @@ def test_upload_endpoint():
         response = requests.post(url, files=files, data=data)
         
         if response.status_code == 200:
-            result = response.json()
-            print("✅ Upload successful!")
-            print(f"Results: {json.dumps(result, indent=2)}")
+            print("✅ Upload answered from the result cache!")
+            print(f"Results: {json.dumps(response.json(), indent=2)}")
             return True
+        elif response.status_code == 202:
+            job = response.json()
+            print(f"✅ Upload accepted as job {job['job_id']}")
+            return wait_for_job(job)
         else:
             print(f"❌ Upload failed with status code: {response.status_code}")
             print(f"Error: {response.text}")
@@ -55,9 +65,34 @@ def test_upload_endpoint():
     finally:
         files['video'].close()
 
+def wait_for_job(job, timeout=600):
+    """Poll a queued analysis job until it finishes"""
+    base_url = "http://localhost:5000"
+    deadline = time.time() + timeout
+    
+    while time.time() < deadline:
+        status = requests.get(base_url + job['status_url']).json()
+        if status['status'] in ('completed', 'failed'):
+            break
+        print(f"Job {status['status']}: {status.get('progress', {})}")
+        time.sleep(1)
+    else:
+        print("❌ Timed out waiting for analysis job")
+        return False
+    
+    response = requests.get(base_url + job['result_url'])
+    if response.status_code == 200:
+        print("✅ Analysis completed!")
+        print(f"Results: {json.dumps(response.json(), indent=2)}")
+        return True
+    
+    print(f"❌ Analysis failed with status code: {response.status_code}")
+    print(f"Error: {response.text}")
+    return False
+
 def test_results_endpoint():
-    """Test the results endpoint"""
-    url = "http://localhost:5000/results/test_video.mp4"
+    """Test the results endpoint for the uploaded video"""
+    url = f"http://localhost:5000/results/{find_test_video()}"
     
     try:
         response = requests.get(url)
@@ -73,6 +108,52 @@ def test_results_endpoint():
         print(f"❌ Error retrieving results: {str(e)}")
         return False
 
+def test_results_list():
+    """Test that the results store lists the uploaded video's results"""
+    url = f"http://localhost:5000/results?video_filename={find_test_video()}"
+    
+    try:
+        response = requests.get(url)
+        if response.status_code == 200 and response.json()['results']:
+            print(f"✅ Results listed successfully! ({len(response.json()['results'])} found)")
+            return True
+        else:
+            print(f"❌ Results list failed with status code: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Error listing results: {str(e)}")
+        return False
+
+def test_overlay_endpoint():
+    """Test that an overlay video is rendered and streamed in byte ranges"""
+    base_url = "http://localhost:5000"
+    video_file = find_test_video()
+    
+    try:
+        with open(os.path.join("uploads", video_file), 'rb') as f:
+            response = requests.post(base_url + "/upload", files={'video': f},
+                                     data={'target_laps': '10', 'overlay': 'on'})
+        result = response.json()
+        if response.status_code == 202:
+            while requests.get(base_url + result['status_url']).json()['status'] in ('queued', 'running'):
+                time.sleep(1)
+            result = requests.get(base_url + result['result_url']).json()
+        
+        overlay_url = (result.get('overlay') or {}).get('url')
+        if not overlay_url:
+            print(f"❌ No overlay rendered: {result.get('overlay') or result.get('error')}")
+            return False
+        response = requests.get(base_url + overlay_url, headers={'Range': 'bytes=0-1023'})
+        if response.status_code == 206 and len(response.content) == 1024:
+            print(f"✅ Overlay streamed in ranges from {overlay_url}")
+            return True
+        else:
+            print(f"❌ Overlay range request failed with status code: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Error rendering overlay: {str(e)}")
+        return False
+
 def test_main_page():
     """Test if the main page loads correctly"""
     url = "http://localhost:5000/"
@@ -89,6 +170,22 @@ def test_main_page():
         print(f"❌ Error loading main page: {str(e)}")
         return False
 
+def test_metrics_endpoint():
+    """Test if stage timings are exported for Prometheus"""
+    url = "http://localhost:5000/metrics"
+    
+    try:
+        response = requests.get(url)
+        if response.status_code == 200 and 'shuttlerun_queue_depth' in response.text:
+            print("✅ Metrics exported successfully!")
+            return True
+        else:
+            print(f"❌ Metrics failed with status code: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Error retrieving metrics: {str(e)}")
+        return False
+
 def main():
     """Run all tests"""
     print("🧪 Testing Shuttle Run Assessment System")
@@ -106,6 +203,16 @@ def main():
     if upload_success:
         print("\n3. Testing results endpoint...")
         test_results_endpoint()
+        test_results_list()
+    
+    # Test 4: Metrics endpoint
+    print("\n4. Testing metrics endpoint...")
+    test_metrics_endpoint()
+    
+    # Test 5: Overlay video (only if upload was successful)
+    if upload_success:
+        print("\n5. Testing overlay video...")
+        test_overlay_endpoint()
     
     print("\n" + "=" * 50)
     print("🎯 Test completed!")
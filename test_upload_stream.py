@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming uploads in upload_stream.py
+Run with: python -m pytest -q test_upload_stream.py
+"""
+
+import glob
+import os
+import tempfile
+import time
+
+from flask import Flask, jsonify, request
+
+from upload_stream import StreamingUploadRequest, remove_stale_uploads
+
+BOUNDARY = 'test-boundary'
+
+def make_app(directory, commit):
+    """An app whose upload route commits the video, or returns without touching it"""
+    app = Flask(__name__)
+    app.request_class = StreamingUploadRequest
+    app.config['UPLOAD_FOLDER'] = directory
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        try:
+            file = request.files.get('video')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if file is None:
+            return jsonify({'error': 'No video file provided'}), 400
+        if commit:
+            file.stream.commit(os.path.join(directory, file.stream.hexdigest() + '.mp4'))
+        return jsonify({'size': file.stream.size})
+
+    return app
+
+def multipart_body(data, finished=True):
+    body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="video"; filename="run.mp4"\r\n'
+            f'Content-Type: video/mp4\r\n\r\n').encode() + data
+    if finished:
+        body += f'\r\n--{BOUNDARY}--\r\n'.encode()
+    return body
+
+def post(app, body):
+    return app.test_client().post('/upload', data=body,
+                                  content_type=f'multipart/form-data; boundary={BOUNDARY}')
+
+def part_files(directory):
+    return glob.glob(os.path.join(directory, '.upload-*.part'))
+
+def test_committed_upload_is_moved_into_place():
+    with tempfile.TemporaryDirectory() as directory:
+        response = post(make_app(directory, commit=True), multipart_body(b'x' * 100000))
+        assert response.status_code == 200
+        assert len(glob.glob(os.path.join(directory, '*.mp4'))) == 1
+        assert part_files(directory) == []
+
+def test_truncated_upload_leaves_no_partial_file():
+    """A body cut off mid-file is deleted when the request closes"""
+    with tempfile.TemporaryDirectory() as directory:
+        response = post(make_app(directory, commit=True), multipart_body(b'x' * 100000, finished=False))
+        assert response.status_code != 200
+        assert part_files(directory) == []
+
+def test_upload_the_view_never_commits_is_deleted():
+    with tempfile.TemporaryDirectory() as directory:
+        response = post(make_app(directory, commit=False), multipart_body(b'x' * 100000))
+        assert response.status_code == 200
+        assert part_files(directory) == []
+
+def test_stale_partial_uploads_are_swept():
+    """Only partial uploads too old to be in progress are removed"""
+    with tempfile.TemporaryDirectory() as directory:
+        stale, fresh = os.path.join(directory, '.upload-a.part'), os.path.join(directory, '.upload-b.part')
+        for path in (stale, fresh):
+            open(path, 'wb').close()
+        old = time.time() - 7200
+        os.utime(stale, (old, old))
+        assert remove_stale_uploads(directory, 3600) == 1
+        assert part_files(directory) == [fresh]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,107 @@
+"""Streaming ingestion of uploaded videos.
+
+Werkzeug normally spools a file upload into a temporary file, after which
+the route copies it into the upload folder and hashes it in a second pass.
+StreamingUploadRequest instead writes each chunk of an uploaded file straight
+into the upload folder as it arrives, hashing it on the way, so a finished
+upload only needs to be renamed into place. Anything the request didn't
+commit is deleted when the request closes.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import Request, current_app
+
+# Partial uploads older than this can't belong to a request still in progress
+STALE_UPLOAD_SECONDS = 3600
+
+
+class HashingUploadFile:
+    """Writable file in the upload folder that hashes everything written to it"""
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        return self._file.flush()
+
+    def hexdigest(self):
+        """SHA-256 of the bytes written so far"""
+        return self._sha256.hexdigest()
+
+    def commit(self, destination):
+        """Move the finished upload to destination"""
+        self._file.close()
+        os.chmod(self.path, 0o644)  # mkstemp creates files readable by the owner only
+        os.replace(self.path, destination)
+        self.committed = True
+
+    def close(self):
+        """Close the file, deleting it unless it was committed"""
+        self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def remove_stale_uploads(directory, max_age_seconds=STALE_UPLOAD_SECONDS):
+    """Delete partial uploads left by a process that died while receiving them
+
+    Returns the number of files removed.
+    """
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for path in glob.glob(os.path.join(directory, '.upload-*.part')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class StreamingUploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._upload_streams = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingUploadFile(current_app.config['UPLOAD_FOLDER'])
+        self._upload_streams.append(stream)
+        return stream
+
+    def close(self):
+        """Also delete every upload the view didn't commit, including ones from an aborted body"""
+        try:
+            super().close()
+        finally:
+            for stream in self._upload_streams:
+                stream.close()
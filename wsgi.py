@@ -0,0 +1,15 @@
+"""WSGI entry point for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module loads the app, OpenCV and NumPy and records how long
+that took; gunicorn.conf.py warms up the web worker once it has forked.
+"""
+
+import time
+
+_started = time.perf_counter()
+
+from app import app, startup_timings  # noqa: E402
+
+startup_timings['import_seconds'] = time.perf_counter() - _started